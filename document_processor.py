@@ -1,23 +1,128 @@
 # Document processing capabilities for various file formats
 import os
-import tempfile
-from typing import List, Dict, Any, Optional, Union
-from dataclasses import dataclass
+import bisect
+import mmap
+import shutil
+import subprocess
+import time
+from collections import OrderedDict
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Union, BinaryIO, Iterator
+from dataclasses import dataclass, replace
+import numpy as np
 import PyPDF2
 import docx2txt
 from bs4 import BeautifulSoup
 import re
 
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+try:
+    from lxml import html as lxml_html
+    # Match the utf-8 decoding used for the other text formats
+    _LXML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+except ImportError:
+    lxml_html = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# One pass over the markdown instead of a separate re.sub per construct
+_MD_RE = re.compile(
+    r"(?P<hdr>^#+\s*)"                # Headers
+    r"|\*\*(?P<b>.*?)\*\*"            # Bold
+    r"|\*(?P<i>.*?)\*"                # Italic
+    r"|`(?P<c>.*?)`"                  # Inline code
+    r"|\[(?P<l>[^\]]+)\]\([^\)]+\)",  # Links
+    re.MULTILINE
+)
+
+_MD_MARKERS = ('#', '*', '`', '[')
+
+# Replacement per matched alternative; anything not listed keeps its captured text
+_MD_REPL = {'hdr': ""}
+
+def _md_sub(match) -> str:
+    kind = match.lastgroup
+    replacement = _MD_REPL.get(kind)
+    return match.group(kind) if replacement is None else replacement
+
+# Text cleanup patterns, plus a translate table that deletes the same special
+# characters for the (very common) pure-ASCII case without running the regex
+_WS_RE = re.compile(r'\s+')
+_SPECIAL_RE = re.compile(r'[^\w\s\.,!?;:()\-\'"]+')
+_ASCII_SPECIAL = str.maketrans("", "", "".join(ch for ch in map(chr, range(128)) if _SPECIAL_RE.match(ch)))
+
+# Bytes that str.split() treats as whitespace, for counting words in raw ASCII text
+_ASCII_WHITESPACE = np.zeros(256, dtype=bool)
+_ASCII_WHITESPACE[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = True
+
+# Sentence boundaries used when chunking
+_PERIOD_RE = re.compile(r'\.')
+
+if njit is not None:
+    @njit(cache=True)
+    def _chunk_offsets_jit(buf, chunk_size, overlap, max_chunks):
+        """Compiled version of the chunking walk over an ASCII byte buffer"""
+        n = buf.shape[0]
+        out = np.empty((max_chunks, 2), np.int64)
+        k = 0
+        start = 0
+        while start < n and k < max_chunks:
+            end = start + chunk_size
+            if end < n:
+                search_start = max(start, end - 100)
+                j = end - 1
+                while j >= search_start and buf[j] != 46:  # ord('.')
+                    j -= 1
+                if j >= search_start and j > start:
+                    end = j + 1
+            out[k, 0] = start
+            out[k, 1] = min(end, n)
+            k += 1
+            start = end - overlap
+        return out[:k]
+else:
+    _chunk_offsets_jit = None
+
 @dataclass
 class ProcessedDocument:
     filename: str
     content: str
     metadata: Dict[str, Any]
-    chunks: List[str] = None
+    # Chunks are kept as (start, end) offsets into content instead of separate
+    # strings, since overlapping chunks would otherwise copy most of the text again
+    chunk_offsets: Optional[np.ndarray] = None
+    
+    @property
+    def chunks(self) -> Optional[List[str]]:
+        """All chunks as a list, sliced out of content again on every access"""
+        if self.chunk_offsets is None:
+            return None
+        return list(self.iter_chunks())
+    
+    def iter_chunks(self) -> Iterator[str]:
+        """Yield chunks one at a time instead of building them all up front"""
+        if self.chunk_offsets is not None:
+            for start, end in self.chunk_offsets.tolist():
+                yield self.content[start:end]
     
 class DocumentProcessor:
     """Process various document formats and extract text content"""
     
+    CACHE_SIZE = 32  # Processed files kept around for re-processing the same file
+    
     def __init__(self):
         self.supported_formats = {
             '.pdf': self._process_pdf,
@@ -27,6 +132,10 @@ class DocumentProcessor:
             '.htm': self._process_html,
             '.md': self._process_markdown,
         }
+        # LRU of processed files keyed by (path, mtime, size), so edits invalidate entries
+        self._cache: "OrderedDict[tuple, ProcessedDocument]" = OrderedDict()
+        # Poppler's pdftotext CLI is the fastest extractor when it's installed
+        self._pdftotext = shutil.which("pdftotext")
     
     def process_file(self, file_path: str) -> ProcessedDocument:
         """Process a single file and extract content"""
@@ -37,161 +146,313 @@ class DocumentProcessor:
             raise ValueError(f"Unsupported file format: {file_ext}")
         
         try:
+            stat = os.stat(file_path)
+            cache_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                return self._copy_document(cached)
+            
             content = self.supported_formats[file_ext](file_path)
-            metadata = self._extract_metadata(file_path, content)
-            chunks = self._chunk_content(content)
+            metadata = self._extract_metadata(file_path, content, file_ext)
+            document = self._build_document(filename, content, metadata)
+            document.chunk_offsets.flags.writeable = False  # Shared by every copy handed out
             
-            return ProcessedDocument(
-                filename=filename,
-                content=content,
-                metadata=metadata,
-                chunks=chunks
-            )
+            self._cache[cache_key] = document
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return self._copy_document(document)
         except Exception as e:
             raise Exception(f"Error processing {filename}: {str(e)}")
     
     def process_uploaded_file(self, uploaded_file) -> ProcessedDocument:
         """Process file uploaded through Gradio"""
         try:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-                tmp_file.write(uploaded_file.read())
-                tmp_path = tmp_file.name
+            file_ext = os.path.splitext(uploaded_file.name)[1].lower()
+            if file_ext not in self.supported_formats:
+                raise ValueError(f"Unsupported file format: {file_ext}")
             
-            # Process the temporary file
-            result = self.process_file(tmp_path)
-            result.filename = uploaded_file.name
-            
-            # Clean up temporary file
-            os.unlink(tmp_path)
-            
-            return result
+            # Every extractor can read the upload straight from memory
+            data = uploaded_file.read()
+            content = self.supported_formats[file_ext](data)
+            metadata = self._extract_metadata(uploaded_file.name, content, file_ext, data)
+            return self._build_document(uploaded_file.name, content, metadata)
         except Exception as e:
             raise Exception(f"Error processing uploaded file: {str(e)}")
     
-    def _process_pdf(self, file_path: str) -> str:
+    @staticmethod
+    def _copy_document(document: ProcessedDocument) -> ProcessedDocument:
+        """
+        A copy of a cached document that callers are free to modify.
+        
+        The metadata dict is copied so annotating it can't change the cached
+        entry; content is an immutable string and chunk_offsets is read-only,
+        so both are shared.
+        """
+        return replace(document, metadata=dict(document.metadata))
+    
+    def _build_document(self, filename: str, content: str, metadata: Dict[str, Any]) -> ProcessedDocument:
+        return ProcessedDocument(
+            filename=filename,
+            content=content,
+            metadata=metadata,
+            chunk_offsets=self._chunk_offsets(content)
+        )
+    
+    def _open_binary(self, source: Union[str, bytes]) -> BinaryIO:
+        """Open a file path, or wrap already-loaded file bytes, as a binary stream"""
+        if isinstance(source, bytes):
+            return BytesIO(source)
+        return open(source, 'rb')
+    
+    def _read_text(self, source: Union[str, bytes], encoding: str = 'utf-8') -> str:
+        if isinstance(source, bytes):
+            return source.decode(encoding)
+        with open(source, 'r', encoding=encoding) as file:
+            return file.read()
+    
+    def _process_pdf(self, source: Union[str, bytes]) -> str:
         """Extract text from PDF file"""
+        if self._pdftotext:
+            in_memory = isinstance(source, bytes)
+            try:
+                result = subprocess.run(
+                    [self._pdftotext, "-q", "-enc", "UTF-8", "-" if in_memory else source, "-"],
+                    input=source if in_memory else None,
+                    stdout=subprocess.PIPE, check=True, timeout=60
+                )
+                return self._clean_text(result.stdout.decode("utf-8", "replace"))
+            except (subprocess.SubprocessError, OSError):
+                pass  # Fall back to the Python extractors below
+        
+        # PDFium (Apache-2.0) and PyMuPDF both parse in compiled code and are much
+        # faster than PyPDF2; PDFium goes first as it has no AGPL strings attached
+        if pdfium is not None:
+            try:
+                pdf = pdfium.PdfDocument(source)
+                try:
+                    # Pages and text pages are native PDFium handles, so each is
+                    # closed as soon as its text has been read
+                    pages_text = []
+                    for page in pdf:
+                        try:
+                            textpage = page.get_textpage()
+                            try:
+                                pages_text.append(textpage.get_text_range())
+                            finally:
+                                textpage.close()
+                        finally:
+                            page.close()
+                    text = "\n".join(pages_text)
+                finally:
+                    pdf.close()
+                return self._clean_text(text)
+            except Exception:
+                pass  # Let the next extractor have a go
+        
+        if fitz is not None:
+            try:
+                if isinstance(source, bytes):
+                    doc = fitz.open(stream=source, filetype="pdf")
+                else:
+                    doc = fitz.open(source)
+                with doc:
+                    text = "\n".join(page.get_text("text") for page in doc)
+                return self._clean_text(text)
+            except fitz.FileDataError:
+                pass  # Damaged or unusual PDF, let PyPDF2 have a go
+        
         try:
-            # Try PyPDF2 first
-            with open(file_path, 'rb') as file:
+            # Fallback: PyPDF2
+            with self._open_binary(source) as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+                # extract_text() returns None for image-only pages
+                text = "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
                 return self._clean_text(text)
         except Exception as e:
             # Fallback: try pypdf
             try:
                 import pypdf
-                with open(file_path, 'rb') as file:
+                with self._open_binary(source) as file:
                     pdf_reader = pypdf.PdfReader(file)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + "\n"
+                    text = "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
                     return self._clean_text(text)
             except:
                 raise Exception(f"Could not extract text from PDF: {str(e)}")
     
-    def _process_txt(self, file_path: str) -> str:
+    def _process_txt(self, source: Union[str, bytes]) -> str:
         """Extract text from plain text file"""
+        if isinstance(source, bytes):
+            return self._decode_txt(source)
+        
+        with open(source, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return ""  # mmap refuses empty files
+            # Decode straight from the mapped pages instead of reading a bytes copy first
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self._decode_txt(mapped)
+    
+    def _decode_txt(self, data) -> str:
+        """Decode text file contents, trying each supported encoding on the same buffer"""
         encodings = ['utf-8', 'latin-1', 'cp1252']
         for encoding in encodings:
             try:
-                with open(file_path, 'r', encoding=encoding) as file:
-                    return file.read()
+                text = str(data, encoding)
             except UnicodeDecodeError:
                 continue
+            # Same newline handling as reading the file in text mode
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            return text
         raise Exception("Could not decode text file with any supported encoding")
     
-    def _process_docx(self, file_path: str) -> str:
+    def _process_docx(self, source: Union[str, bytes]) -> str:
         """Extract text from DOCX file"""
         try:
-            text = docx2txt.process(file_path)
+            text = docx2txt.process(BytesIO(source) if isinstance(source, bytes) else source)
             return self._clean_text(text)
         except Exception as e:
             raise Exception(f"Could not extract text from DOCX: {str(e)}")
     
-    def _process_html(self, file_path: str) -> str:
+    def _process_html(self, source: Union[str, bytes]) -> str:
         """Extract text from HTML file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                soup = BeautifulSoup(file.read(), 'html.parser')
-                
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                
-                text = soup.get_text()
-                return self._clean_text(text)
+            if lxml_html is not None:
+                return self._process_html_lxml(source)
+            
+            soup = BeautifulSoup(self._read_text(source), 'html.parser')
+            
+            # Remove script and style elements
+            for script in soup(["script", "style"]):
+                script.decompose()
+            
+            text = soup.get_text()
+            return self._clean_text(text)
         except Exception as e:
             raise Exception(f"Could not extract text from HTML: {str(e)}")
     
-    def _process_markdown(self, file_path: str) -> str:
+    def _process_html_lxml(self, source: Union[str, bytes]) -> str:
+        """Same extraction as _process_html using lxml's C parser, which is far faster than html.parser"""
+        with self._open_binary(source) as file:
+            data = file.read()
+        if not data.strip():
+            return ""
+        
+        tree = lxml_html.document_fromstring(data, parser=_LXML_PARSER)
+        for element in tree.xpath('//script|//style'):
+            element.drop_tree()  # Unlike parent.remove(), keeps the text that follows the tag
+        return self._clean_text(tree.text_content())
+    
+    def _process_markdown(self, source: Union[str, bytes]) -> str:
         """Extract text from Markdown file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                
-                # Remove markdown formatting (basic)
-                content = re.sub(r'^#+\s*', '', content, flags=re.MULTILINE)  # Headers
-                content = re.sub(r'\*\*(.*?)\*\*', r'\1', content)  # Bold
-                content = re.sub(r'\*(.*?)\*', r'\1', content)  # Italic
-                content = re.sub(r'`(.*?)`', r'\1', content)  # Inline code
-                content = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', content)  # Links
-                
-                return self._clean_text(content)
+            content = self._read_text(source)
+            
+            # Remove markdown formatting (basic); every construct starts with one
+            # of these characters, so plain text can skip the regex entirely
+            if any(marker in content for marker in _MD_MARKERS):
+                content = _MD_RE.sub(_md_sub, content)
+            
+            return self._clean_text(content)
         except Exception as e:
             raise Exception(f"Could not extract text from Markdown: {str(e)}")
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize extracted text"""
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = _WS_RE.sub(' ', text)
         # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s\.,!?;:()\-\'"]+', '', text)
+        if text.isascii():
+            text = text.translate(_ASCII_SPECIAL)
+        else:
+            text = _SPECIAL_RE.sub('', text)
         # Strip leading/trailing whitespace
         text = text.strip()
         return text
     
-    def _extract_metadata(self, file_path: str, content: str) -> Dict[str, Any]:
-        """Extract metadata from file"""
-        stat = os.stat(file_path)
+    def _extract_metadata(self, file_path: str, content: str, file_ext: Optional[str] = None,
+                          data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Extract metadata from file, or from the bytes of an upload that never touched disk"""
+        if data is None:
+            stat = os.stat(file_path)
+            file_size, modified = stat.st_size, stat.st_mtime
+        else:
+            file_size, modified = len(data), time.time()
+        if file_ext is None:
+            file_ext = os.path.splitext(file_path)[1].lower()
         return {
-            'file_size': stat.st_size,
-            'word_count': len(content.split()),
+            'file_size': file_size,
+            'word_count': self._count_words(content),
             'char_count': len(content),
-            'file_type': os.path.splitext(file_path)[1].lower(),
-            'processed_date': str(stat.st_mtime)
+            'file_type': file_ext,
+            'processed_date': str(modified)
         }
     
+    def _count_words(self, content: str) -> int:
+        """Count whitespace-separated words without building the list of words"""
+        # _clean_text leaves words separated by exactly one space, so counting
+        # the separators is enough; raw text (e.g. .txt files) takes the slow path
+        if content.isprintable() and '  ' not in content and content[:1] != ' ' and content[-1:] != ' ':
+            return content.count(' ') + 1 if content else 0
+        if content.isascii():
+            # A word starts wherever a non-whitespace byte follows whitespace (or the start)
+            is_space = _ASCII_WHITESPACE[np.frombuffer(content.encode('ascii'), np.uint8)]
+            return int(np.count_nonzero(is_space[:-1] & ~is_space[1:])) + (not is_space[0])
+        return len(content.split())
+    
     def _chunk_content(self, content: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """Split content into overlapping chunks for better retrieval"""
-        if len(content) <= chunk_size:
-            return [content]
+        offsets = self._chunk_offsets(content, chunk_size, overlap)
+        return [content[start:end] for start, end in offsets.tolist()]
+    
+    def _chunk_offsets(self, content: str, chunk_size: int = 1000, overlap: int = 200) -> np.ndarray:
+        """Find overlapping chunks as an (n, 2) array of (start, end) offsets into content"""
+        n = len(content)
+        if n <= chunk_size:
+            return np.array([[0, n]], dtype=np.int64)
         
-        chunks = []
-        start = 0
+        # Every chunk advances the start by at least chunk_size - overlap - 100
+        max_chunks = n // max(1, chunk_size - overlap - 100) + 2
         
-        while start < len(content):
-            end = start + chunk_size
-            
-            # Try to break at sentence boundary
-            if end < len(content):
-                # Look for sentence ending within the last 100 characters
-                search_start = max(start, end - 100)
-                sentence_end = content.rfind('.', search_start, end)
-                if sentence_end > start:
-                    end = sentence_end + 1
+        # Byte offsets only line up with string indices for ASCII text
+        if _chunk_offsets_jit is not None and content.isascii():
+            buf = np.frombuffer(content.encode('ascii'), np.uint8)
+            spans = _chunk_offsets_jit(buf, chunk_size, overlap, max_chunks).tolist()
+        else:
+            spans = [None] * max_chunks
+            k = 0
+            start = 0
+            # Offsets just past every period, so each boundary lookup is a bisect
+            period_ends = [m.end() for m in _PERIOD_RE.finditer(content)]
             
-            chunk = content[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-            if start >= len(content):
-                break
+            while start < n and k < max_chunks:
+                end = start + chunk_size
+                
+                # Try to break at sentence boundary
+                if end < n:
+                    # Look for sentence ending within the last 100 characters
+                    search_start = max(start, end - 100)
+                    i = bisect.bisect_right(period_ends, end) - 1
+                    if i >= 0 and period_ends[i] > search_start and period_ends[i] > start + 1:
+                        end = period_ends[i]
+                
+                spans[k] = (start, min(end, n))
+                k += 1
+                
+                start = end - overlap
+            del spans[k:]
+        
+        # Trim surrounding whitespace off each chunk and drop the empty ones
+        offsets = []
+        for start, end in spans:
+            while start < end and content[start].isspace():
+                start += 1
+            while end > start and content[end - 1].isspace():
+                end -= 1
+            if start < end:
+                offsets.append((start, end))
         
-        return chunks
+        return np.array(offsets, dtype=np.int64).reshape(-1, 2)
 
 # Global instance
 _document_processor = None
@@ -213,6 +474,14 @@ def process_uploaded_document(uploaded_file) -> ProcessedDocument:
     processor = get_document_processor()
     return processor.process_uploaded_file(uploaded_file)
 
+def process_documents(file_paths: List[str], max_workers: Optional[int] = None) -> List[ProcessedDocument]:
+    """Process several document files in parallel, one worker process per CPU by default"""
+    if len(file_paths) <= 1:
+        return [process_document(path) for path in file_paths]
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(process_document, file_paths))
+
 # Test function
 def test_document_processing():
     """Test document processing functionality"""
@@ -29,13 +29,19 @@ from dotenv import load_dotenv
 from typing import List, Tuple, Dict, Any
 import html
 import random
+import re
 
 # Load environment variables
 load_dotenv()
 
 # Import our modules
 from python_search import search_web, SearchResult
-from python_openrouter import get_openrouter_client
+from python_openrouter import get_openrouter_client, buffered_stream, coalesce_stream
+from ui_helpers import AnswerCache, minify_css
+
+# Set DEMO_ANIMATIONS=1 to bring back the paced, step-by-step searching and
+# reviewing animations. Off by default since they only add waiting time.
+DEMO_ANIMATIONS = bool(os.getenv("DEMO_ANIMATIONS"))
 
 # Enhanced CSS for modern, Perplexity-inspired styling
 custom_css = """
@@ -359,6 +365,17 @@ custom_css = """
 }
 """
 
+# Minified once at import; Gradio sends this with every page load
+custom_css = minify_css(custom_css)
+
+# Every possible progress bar, built once instead of on each status update
+_BARS = tuple("█" * i + "░" * (20 - i) for i in range(21))
+_REVIEW_BARS = tuple("📖" * i + "📄" * (15 - i) for i in range(16))
+
+_DOTS = '<div class="loading-dots"><span></span><span></span><span></span></div>'
+_SEARCH_HEADER = f'<div class="loading-text">🔍 **Searching the web for you**</div>\n{_DOTS}\n\n'
+_REVIEW_HEADER = f'<div class="loading-text">📚 **Analyzing sources & extracting insights**</div>\n{_DOTS}\n\n'
+
 def format_search_status(current_site: str, completed_sites: List[str], total_sites: int) -> str:
     """
     Creates a visually appealing search status display with progress indicators.
@@ -376,35 +393,21 @@ def format_search_status(current_site: str, completed_sites: List[str], total_si
     Returns:
         A nicely formatted status string with emojis and progress info
     """
-    status_lines = []
-    
-    # Create an engaging header with loading animation
-    status_lines.append('<div class="loading-text">🔍 **Searching the web for you**</div>')
-    status_lines.append('<div class="loading-dots"><span></span><span></span><span></span></div>')
-    status_lines.append("")
-    
     # Show what we're currently working on
-    if current_site:
-        status_lines.append(f"🔍 Currently exploring: **{current_site}**")
-        status_lines.append("")
+    current = f"🔍 Currently exploring: **{current_site}**\n\n" if current_site else ""
     
     # Display completed searches with checkmarks
-    if completed_sites:
-        status_lines.append("**Sources found:**")
-        for site in completed_sites:
-            status_lines.append(f"✅ {site}")
-        status_lines.append("")
+    found = "".join(f"✅ {site}\n" for site in completed_sites)
+    if found:
+        found = f"**Sources found:**\n{found}\n"
     
     # Progress bar visualization
     progress = len(completed_sites) / total_sites if total_sites > 0 else 0
-    progress_bar_length = 20
-    filled_length = int(progress_bar_length * progress)
-    bar = "█" * filled_length + "░" * (progress_bar_length - filled_length)
-    
-    status_lines.append(f"📊 **Progress:** {len(completed_sites)}/{total_sites} sources")
-    status_lines.append(f"⏳ {bar} {int(progress * 100)}%")
+    bar = _BARS[min(int(20 * progress), 20)]
     
-    return "\n".join(status_lines)
+    return (f"{_SEARCH_HEADER}{current}{found}"
+            f"📊 **Progress:** {len(completed_sites)}/{total_sites} sources\n"
+            f"⏳ {bar} {int(progress * 100)}%")
 
 def format_reviewing_status(current_idx: int, total_sources: int, current_source: str) -> str:
     """
@@ -422,29 +425,17 @@ def format_reviewing_status(current_idx: int, total_sources: int, current_source
     Returns:
         A formatted status string showing review progress
     """
-    status_lines = []
-    
-    # Eye-catching header with context
-    status_lines.append('<div class="loading-text">📚 **Analyzing sources & extracting insights**</div>')
-    status_lines.append('<div class="loading-dots"><span></span><span></span><span></span></div>')
-    status_lines.append("")
-    
     # Show current focus
-    if current_source:
-        status_lines.append(f"📖 Currently reading: **{current_source}**")
-        status_lines.append("")
+    current = f"📖 Currently reading: **{current_source}**\n\n" if current_source else ""
     
     # Visual progress indicator
     progress = current_idx / total_sources if total_sources > 0 else 0
-    progress_bar_length = 15
-    filled_length = int(progress_bar_length * progress)
-    bar = "📖" * filled_length + "📄" * (progress_bar_length - filled_length)
-    
-    status_lines.append(f"**Analysis Progress:** {current_idx}/{total_sources} sources")
-    status_lines.append(f"📊 {bar}")
-    status_lines.append(f"⏳ {int(progress * 100)}% complete")
+    bar = _REVIEW_BARS[min(int(15 * progress), 15)]
     
-    return "\n".join(status_lines)
+    return (f"{_REVIEW_HEADER}{current}"
+            f"**Analysis Progress:** {current_idx}/{total_sources} sources\n"
+            f"📊 {bar}\n"
+            f"⏳ {int(progress * 100)}% complete")
 
 def format_sources_display(search_results: List[SearchResult]) -> str:
     """
@@ -464,31 +455,79 @@ def format_sources_display(search_results: List[SearchResult]) -> str:
     if not search_results:
         return "📝 **No sources found for this query.**\n\nThis might happen if the search didn't return any results. Try rephrasing your question!"
     
-    sources_html = []
-    sources_html.append("### 📚 Sources & References")
-    sources_html.append("*Click any source title to read the full article*")
-    sources_html.append("")
+    # Numbered citation badge and clickable title for each source, with its domain underneath
+    sources = "\n".join(
+        f'<span class="citation">{i}</span> <a href="{html.escape(result.url)}" target="_blank" class="source-link">{html.escape(result.title)}</a>\n'
+        f"<small style='color: #9ca3af; margin-left: 28px; display: block; margin-bottom: 8px;'>🌐 {html.escape(result.domain)}</small>"
+        for i, result in enumerate(search_results, 1)
+    )
+    
+    return (
+        "### 📚 Sources & References\n"
+        "*Click any source title to read the full article*\n\n"
+        f"{sources}\n\n"
+        "*All sources open in a new tab to preserve your research session*"
+    )
+
+# Topics shown in the searching animation, picked by what the query is about
+_DEFAULT_SITES = (
+    "software engineering job market 2025",
+    "software engineer hiring trends 2025",
+    "demand for software engineers 2025",
+)
+_AI_SITES = (
+    "artificial intelligence trends 2025",
+    "AI job market 2025",
+    "machine learning careers",
+)
+_CLIMATE_SITES = (
+    "climate change impacts",
+    "global warming effects",
+    "environmental policy 2025",
+)
+_SITES_BY_CAT = {"ai": _AI_SITES, "climate": _CLIMATE_SITES}
+_CATEGORY_RE = re.compile(r"(?P<ai>\bai\b|artificial intelligence)|(?P<climate>climate|global warming)", re.I)
+
+# Progress messages for each step of the search
+_LOADING_MESSAGES = (
+    "🔍 Searching the web for the latest information...",
+    "🌐 Exploring trusted sources and databases...",
+    "📊 Gathering comprehensive data from multiple sites...",
+    "🔎 Finding the most relevant and up-to-date content...",
+    "📈 Collecting insights from authoritative sources...",
+)
+_ANALYSIS_MESSAGES = (
+    "📖 Reading articles and extracting key insights...",
+    "🔍 Analyzing content for accuracy and relevance...",
+    "💡 Identifying the most important information...",
+    "📊 Cross-referencing facts across sources...",
+    "🎯 Focusing on what matters most for your question...",
+)
+_SYNTHESIS_STATUS = f'<div class="loading-text">🤖 **Synthesizing information with AI intelligence...**</div>{_DOTS}'
+
+# Recently answered questions, so repeated ones (like the example prompts) skip
+# search and synthesis
+_ANSWER_CACHE = AnswerCache(size=256, ttl=3600)
+
+class _UpdateThrottle:
+    """
+    Limits how often progress updates are pushed to the browser.
     
-    for i, result in enumerate(search_results, 1):
-        # Create a beautiful numbered citation badge
-        citation = f'<span class="citation">{i}</span>'
-        
-        # Extract domain name for display (remove www. if present)
-        domain = result.domain if hasattr(result, 'domain') else result.url.split('/')[2]
-        if domain.startswith('www.'):
-            domain = domain[4:]
-        
-        # Create an attractive, clickable source link
-        source_link = f'<a href="{result.url}" target="_blank" class="source-link">{result.title}</a>'
-        
-        # Combine everything with nice styling
-        sources_html.append(f"{citation} {source_link}")
-        sources_html.append(f"<small style='color: #9ca3af; margin-left: 28px; display: block; margin-bottom: 8px;'>🌐 {domain}</small>")
+    Every yield makes Gradio send the whole status Markdown to the client and
+    re-render it, so intermediate updates closer together than `interval`
+    seconds are dropped. Phase changes and final results bypass this.
+    """
     
-    sources_html.append("")
-    sources_html.append("*All sources open in a new tab to preserve your research session*")
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._last = 0.0
     
-    return "\n".join(sources_html)
+    def ready(self) -> bool:
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
 
 async def process_query(query: str, progress=gr.Progress()) -> Tuple[str, str, str]:
     """
@@ -508,104 +547,108 @@ async def process_query(query: str, progress=gr.Progress()) -> Tuple[str, str, s
         yield "🔍 Please enter a question to get started!", "", ""
         return
     
+    cache_key = _ANSWER_CACHE.key(query)
+    cached = _ANSWER_CACHE.get(cache_key)
+    if cached is not None:
+        yield "", *cached
+        return
+    
+    throttle = _UpdateThrottle()
+    
     try:
         # Initialize
         progress(0, desc="Initializing search...")
-        await asyncio.sleep(0.5)
+        if DEMO_ANIMATIONS:
+            await asyncio.sleep(0.5)
         
         # Define search sites based on query
-        search_sites = [
-            "software engineering job market 2025",
-            "software engineer hiring trends 2025", 
-            "demand for software engineers 2025"
-        ]
+        match = _CATEGORY_RE.search(query)
+        search_sites = _SITES_BY_CAT.get(match.lastgroup if match else None, _DEFAULT_SITES)
         
-        if "ai" in query.lower() or "artificial intelligence" in query.lower():
-            search_sites = [
-                "artificial intelligence trends 2025",
-                "AI job market 2025",
-                "machine learning careers"
-            ]
-        elif "climate" in query.lower():
-            search_sites = [
-                "climate change impacts",
-                "global warming effects",
-                "environmental policy 2025"
-            ]
+        # Start the real search now; the animation below plays while it runs
+        search_task = asyncio.create_task(search_web(query))
         
         # Enhanced Step 1: Animated Search with Dynamic Messages
-        loading_messages = [
-            "🔍 Searching the web for the latest information...",
-            "🌐 Exploring trusted sources and databases...",
-            "📊 Gathering comprehensive data from multiple sites...",
-            "🔎 Finding the most relevant and up-to-date content...",
-            "📈 Collecting insights from authoritative sources..."
-        ]
-        
-        completed_sites = []
-        for i, site in enumerate(search_sites):
-            # Show dynamic loading message
-            loading_msg = loading_messages[i % len(loading_messages)]
-            progress((i + 0.3) / (len(search_sites) + 3), desc=loading_msg)
+        if DEMO_ANIMATIONS:
+            completed_sites = []
+            for i, site in enumerate(search_sites):
+                # Show dynamic loading message
+                loading_msg = _LOADING_MESSAGES[i % len(_LOADING_MESSAGES)]
+                progress((i + 0.3) / (len(search_sites) + 3), desc=loading_msg)
             
-            status = format_search_status(site, completed_sites, len(search_sites))
-            yield status, "", ""
-            await asyncio.sleep(1.2)  # Slightly longer for better user experience
+                status = format_search_status(site, completed_sites, len(search_sites))
+                if throttle.ready():
+                    yield status, "", ""
+                await asyncio.sleep(1.2)  # Slightly longer for better user experience
             
-            completed_sites.append(site)
-            status = format_search_status("", completed_sites, len(search_sites))
-            progress((i + 0.8) / (len(search_sites) + 3), desc=f"✅ Found valuable content from {site}")
-            yield status, "", ""
-            await asyncio.sleep(0.6)
+                completed_sites.append(site)
+                status = format_search_status("", completed_sites, len(search_sites))
+                progress((i + 0.8) / (len(search_sites) + 3), desc=f"✅ Found valuable content from {site}")
+                if throttle.ready():
+                    yield status, "", ""
+                await asyncio.sleep(0.6)
+        else:
+            progress(0.3, desc=_LOADING_MESSAGES[0])
+            yield format_search_status("", [], len(search_sites)), "", ""
         
         # Step 2: Perform actual search
         progress(0.7, desc="Gathering search results...")
-        search_response = await search_web(query)
-        await asyncio.sleep(1)
+        search_response = await search_task
         
-        # Enhanced Step 3: Intelligent Source Analysis Animation
-        analysis_messages = [
-            "📖 Reading articles and extracting key insights...",
-            "🔍 Analyzing content for accuracy and relevance...",
-            "💡 Identifying the most important information...",
-            "📊 Cross-referencing facts across sources...",
-            "🎯 Focusing on what matters most for your question..."
-        ]
+        # Start the AI synthesis right away - connecting and waiting for the
+        # first token overlaps with the review animation
+        client = get_openrouter_client()
+        answer_stream = buffered_stream(client.synthesize_search_results_stream(query, search_response.results))
+        first_token = asyncio.create_task(answer_stream.__anext__())
         
-        for i in range(len(search_response.results)):
-            current_source = search_response.results[i].domain if i < len(search_response.results) else ""
-            analysis_msg = analysis_messages[i % len(analysis_messages)]
+        try:
+            # Enhanced Step 3: Intelligent Source Analysis Animation
+            if DEMO_ANIMATIONS:
+                for i in range(len(search_response.results)):
+                    current_source = search_response.results[i].domain if i < len(search_response.results) else ""
+                    analysis_msg = _ANALYSIS_MESSAGES[i % len(_ANALYSIS_MESSAGES)]
+                
+                    status = format_reviewing_status(i + 1, len(search_response.results), current_source)
+                    progress(0.65 + (i + 1) * 0.2 / len(search_response.results), desc=analysis_msg)
+                    if throttle.ready():
+                        yield status, "", ""
+                    await asyncio.sleep(0.9)  # Slightly slower for better perception
             
-            status = format_reviewing_status(i + 1, len(search_response.results), current_source)
-            progress(0.65 + (i + 1) * 0.2 / len(search_response.results), desc=analysis_msg)
-            yield status, "", ""
-            await asyncio.sleep(0.9)  # Slightly slower for better perception
-        
-        # Enhanced Step 4: AI Synthesis with Engaging Messages
-        synthesis_messages = [
-            "🤖 **Synthesizing information with AI intelligence...**",
-            "🧠 **Crafting a comprehensive, well-researched answer...**",
-            "✨ **Applying advanced reasoning to your question...**",
-            "📝 **Building a clear, informative response...**"
-        ]
-        
-        for i, msg in enumerate(synthesis_messages):
-            progress_val = 0.85 + (i + 1) * 0.03
-            progress(progress_val, desc=msg.replace('*', '').replace('🤖 ', '').replace('🧠 ', '').replace('✨ ', '').replace('📝 ', ''))
-            yield f'<div class="loading-text">{msg}</div><div class="loading-dots"><span></span><span></span><span></span></div>', "", ""
-            await asyncio.sleep(0.8)
-        
-        # Get AI synthesis
-        client = get_openrouter_client()
-        ai_response = client.synthesize_search_results(query, search_response.results)
+            # Step 4: Wait for the AI to start writing if it hasn't already
+            if not first_token.done():
+                progress(0.9, desc="Synthesizing information with AI intelligence...")
+                yield _SYNTHESIS_STATUS, "", ""
+            try:
+                answer_parts = [await first_token]
+            except StopAsyncIteration:
+                answer_parts = []
+            
+            # Show the answer as it's written
+            async for piece in coalesce_stream(answer_stream):
+                answer_parts.append(piece)
+                if throttle.ready():
+                    yield "", "".join(answer_parts), ""
+            ai_response = "".join(answer_parts)
+        finally:
+            # Don't leave the LLM call running if the user navigated away
+            if not first_token.done():
+                first_token.cancel()
+            else:
+                await answer_stream.aclose()
         
         # Format sources
         sources_display = format_sources_display(search_response.results)
         
+        if ai_response:
+            _ANSWER_CACHE.put(cache_key, ai_response, sources_display)
+        
         progress(1.0, desc="Complete!")
         yield "", ai_response, sources_display
         
     except Exception as e:
+        if 'search_task' in locals() and not search_task.done():
+            search_task.cancel()
+        
         # More user-friendly error handling with helpful suggestions
         error_msg = f"🚨 **We encountered an issue while researching your question**\n\n"
                 
@@ -626,6 +669,15 @@ async def process_query(query: str, progress=gr.Progress()) -> Tuple[str, str, s
         print(f"Detailed error in process_query: {e}")
         yield "", error_msg, ""
 
+# Open the font connections early and load the Inter stylesheet without
+# blocking first paint (the system font stack is shown until it arrives)
+_FONTS_HEAD = (
+    "<link rel='preconnect' href='https://fonts.googleapis.com'>"
+    "<link rel='preconnect' href='https://fonts.gstatic.com' crossorigin>"
+    "<link href='https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap' "
+    "rel='stylesheet' media='print' onload=\"this.media='all'\">"
+)
+
 def create_interface():
     """Create the Gradio interface"""
     
@@ -652,7 +704,7 @@ def create_interface():
             block_label_text_color="#d1d5db",
         ),
         title="AI Research Assistant - Powered by Advanced AI",
-        head="<link href='https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap' rel='stylesheet'>"
+        head=_FONTS_HEAD
     ) as demo:
         
         # Enhanced Header with Beautiful Styling
@@ -717,73 +769,16 @@ def create_interface():
             label="💡 Try these research questions to get started"
         )
         
-        # Event handlers
-        def handle_search(query):
-            """
-            Handle search requests with comprehensive error handling and user feedback.
-            
-            This is the main function that gets called when users click the search button
-            or press Enter. It orchestrates the entire search and synthesis process,
-            making sure users get helpful feedback at every step.
-            
-            The function runs asynchronously to prevent the UI from freezing while
-            we're doing the heavy lifting of searching the web and processing results.
-            """
-            def process():
-                if not query.strip():
-                    return "🔍 Start by typing a question above!", "", ""
-                
-                try:
-                    # Create or get the event loop for async operations
-                    try:
-                        loop = asyncio.get_event_loop()
-                    except RuntimeError:
-                        # Create a new loop if we're in a different thread
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                    
-                    # Run our async search process and collect the final results
-                    async def run_process():
-                        final_status, final_answer, final_sources = "", "", ""
-                        async for status, answer, sources in process_query(query):
-                            final_status, final_answer, final_sources = status, answer, sources
-                        return final_status, final_answer, final_sources
-                    
-                    return loop.run_until_complete(run_process())
-                    
-                except Exception as e:
-                    # Provide helpful error messages to users
-                    error_msg = f"🚨 **We hit a snag while processing your request!**\n\n"
-                    
-                    if "network" in str(e).lower() or "connection" in str(e).lower():
-                        error_msg += "🌐 It looks like there might be a network connectivity issue.\n"
-                        error_msg += "Please check your internet connection and try again.\n\n"
-                    elif "api" in str(e).lower():
-                        error_msg += "🔑 There seems to be an issue with our AI service.\n"
-                        error_msg += "Don't worry, this is usually temporary. Please try again in a moment.\n\n"
-                    else:
-                        error_msg += f"📝 Error details: {str(e)}\n\n"
-                    
-                    error_msg += "💡 **Quick fixes to try:**\n"
-                    error_msg += "- Refresh the page and try again\n"
-                    error_msg += "- Rephrase your question\n"
-                    error_msg += "- Wait a minute and retry\n\n"
-                    error_msg += "Thanks for your patience! We're working to make this better every day. 🚀"
-                    
-                    print(f"Error in handle_search: {e}")
-                    return "", error_msg, ""
-            
-            return process()
-        
-        # Bind events
+        # Bind events - Gradio drives the async generator itself and streams
+        # every yielded status update to the page
         search_btn.click(
-            handle_search,
+            process_query,
             inputs=[query_input],
             outputs=[search_status, answer_output, sources_output]
         )
         
         query_input.submit(
-            handle_search,
+            process_query,
             inputs=[query_input],
             outputs=[search_status, answer_output, sources_output]
         )
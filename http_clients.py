@@ -0,0 +1,62 @@
+# Pooled httpx clients shared by the OpenRouter client and the web search
+import asyncio
+from typing import Callable, Dict
+
+import httpx
+
+
+class LoopClients:
+    """
+    One pooled httpx.AsyncClient per event loop.
+
+    httpx connections belong to the event loop that opened them, and our async
+    code runs on more than one loop (Gradio's, the RAG system's background loop,
+    asyncio.run in scripts). Keeping a client per loop, instead of replacing a
+    single client whenever the loop changes, means switching loops never
+    abandons a connection pool with its sockets still open.
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncClient]):
+        self._factory = factory
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._clients)
+
+    def get(self) -> httpx.AsyncClient:
+        """The client for the running event loop, created on first use"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            # Forget clients whose loop has been closed; nothing can run their
+            # cleanup any more, and holding on to them would keep the loops alive
+            for dead in [other for other in self._clients if other.is_closed()]:
+                del self._clients[dead]
+            client = self._clients[loop] = self._factory()
+        return client
+
+    async def aclose(self) -> None:
+        """Close every client whose loop can still run the close"""
+        current = asyncio.get_running_loop()
+        for loop, client in list(self._clients.items()):
+            if loop is current:
+                await client.aclose()
+            elif loop.is_running():
+                # Connections must be closed on their own loop, in its own thread
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), loop))
+            else:
+                continue  # A stopped loop is left for close()
+            del self._clients[loop]
+
+    def close(self) -> None:
+        """Blocking version of aclose, for atexit hooks where no loop is running"""
+        clients, self._clients = self._clients, {}
+        for loop, client in clients.items():
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+                elif not loop.is_closed():
+                    loop.run_until_complete(client.aclose())
+            except Exception:
+                # The loop that owned the connections went away mid-shutdown
+                pass
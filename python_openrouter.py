@@ -18,12 +18,39 @@ Features:
 - Error handling and fallbacks
 - Optimized prompts for research tasks
 """
-import requests
+import asyncio
+import atexit
+import functools
+import httpx
 import os
-from typing import List, Dict, Any, Optional
+import re
+import json
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from dataclasses import dataclass
+from http_clients import LoopClients
 
-@dataclass
+try:
+    import h2  # enables HTTP/2 in httpx
+except ImportError:
+    h2 = None
+
+try:
+    import orjson  # much faster JSON for our large prompt/response payloads
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken  # local token counting, so oversized prompts never leave the machine
+except ImportError:
+    tiktoken = None
+
+try:
+    import brotli  # lets httpx decode br-compressed responses
+except ImportError:
+    brotli = None
+
+@dataclass(slots=True)
 class ChatMessage:
     """
     Represents a single message in our conversation with the AI.
@@ -37,6 +64,9 @@ class ChatMessage:
     """
     role: str     # 'system' (instructions), 'user' (our question), or 'assistant' (AI response)
     content: str  # The actual text of the message
+    
+    def to_dict(self) -> Dict[str, str]:
+        return {'role': self.role, 'content': self.content}
 
 @dataclass
 class ChatResponse:
@@ -50,6 +80,53 @@ class ChatResponse:
     content: str                           # The AI's synthesized answer
     usage: Optional[Dict[str, int]] = None # Token usage stats (input/output tokens)
 
+class OpenRouterError(Exception):
+    """The AI service answered with an HTTP error (status_code tells us which)"""
+    
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+if orjson is not None:
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+    _json_loads = json.loads
+
+@functools.cache
+def _get_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # The encoding file couldn't be fetched (e.g. offline); fall back to estimating
+        return None
+
+def count_tokens(messages: List[ChatMessage]) -> int:
+    """
+    Count how many prompt tokens our messages will take up.
+    
+    Uses tiktoken when it's installed; otherwise estimates with the usual
+    rule of thumb of about four characters per token. Either way it's an
+    approximation of what DeepSeek's own tokenizer will say.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return sum(len(msg.content) for msg in messages) // 4 + 1
+    return sum(len(encoding.encode(msg.content)) for msg in messages)
+
+# Splits a batched reply into its "### Answer N:" sections
+_ANSWER_SPLIT_RE = re.compile(r'^###\s*Answer\s+(\d+):?[ \t]*', re.MULTILINE)
+
+# Longest snippet we put in front of the model, in characters
+_MAX_SNIPPET_CHARS = 280
+
+# How each search result is laid out in the synthesis prompt
+_SOURCE_FMT = "[{}] {}\nSource: {}\nURL: {}\nContent: {}\n".format
+
 class OpenRouterClient:
     """
     Our gateway to advanced AI models through OpenRouter.
@@ -63,6 +140,18 @@ class OpenRouterClient:
     scaling, or keeping up with the rapidly evolving AI landscape.
     """
     
+    # Limits for chat_many(): how many requests may be in flight at once, and
+    # how often to retry when OpenRouter says we're being rate limited
+    MAX_CONCURRENT_REQUESTS = 10
+    MAX_RETRIES = 3
+    
+    # Number of synthesized answers to remember for repeated questions
+    SYNTHESIS_CACHE_SIZE = 256
+    
+    # DeepSeek V3's context window, and how much of it we leave for the answer
+    CONTEXT_LIMIT = 64000
+    MAX_TOKENS = 4000
+
     def __init__(self, api_key: str):
         """
         Set up our connection to the AI service.
@@ -73,8 +162,105 @@ class OpenRouterClient:
         self.api_key = api_key
         self.base_url = 'https://openrouter.ai/api/v1'
         self.model = 'deepseek/deepseek-chat'  # DeepSeek V3 - excellent for research tasks
+        
+        # Sent with every request; set once on the HTTP client
+        self._headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+            'HTTP-Referer': os.getenv('APP_URL', 'http://localhost:7860'),
+            'X-Title': 'AI Research Assistant - Powered by DeepSeek V3',
+            # Compressed responses are decoded by httpx; only offer br if we can read it
+            'Accept-Encoding': 'gzip, br' if brotli is not None else 'gzip'
+        }
+        
+        # Request settings that are the same for every call
+        self._base_body = {
+            'model': self.model,
+            'temperature': 0.2,    # Lower temperature for more focused, factual responses
+            'max_tokens': self.MAX_TOKENS,  # Generous limit for comprehensive answers
+            'top_p': 0.9,         # Slight randomness to keep responses natural
+            'frequency_penalty': 0.1,  # Reduce repetition
+            'presence_penalty': 0.1    # Encourage diverse vocabulary
+        }
+        
+        # Async HTTP client with a keep-alive pool, so we only pay for the
+        # TCP/TLS handshake once (HTTP/2 when the h2 package is available).
+        # One per event loop, created on first use, since connections (and
+        # semaphores) can't be shared across loops.
+        self._async_clients = LoopClients(lambda: httpx.AsyncClient(**self._client_options()))
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        
+        # (normalized query, source URLs) -> synthesized answer, least recently used first
+        self._synthesis_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], str]" = OrderedDict()
+
+    def _client_options(self) -> Dict[str, Any]:
+        return {
+            'base_url': self.base_url,
+            'headers': self._headers,
+            'http2': h2 is not None,
+            'limits': httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            'timeout': httpx.Timeout(60, connect=5)
+        }
+
+    def _payload(self, messages: List[ChatMessage], stream: bool = False) -> Dict[str, Any]:
+        return {
+            **self._base_body,
+            # orjson serializes dataclasses natively, so no per-message dicts needed
+            'messages': list(messages) if orjson is not None else [msg.to_dict() for msg in messages],
+            'stream': stream       # Complete response at once, or token by token
+        }
+
+    def _parse_response(self, ok: bool, status_code: int, content: bytes) -> ChatResponse:
+        """Turn a raw OpenRouter HTTP response (status and body) into a ChatResponse"""
+        # Check if the AI service responded successfully
+        if not ok:
+            error_data = _json_loads(content) if content else {}
+            error_message = error_data.get('error', {}).get('message', 'Unknown error occurred')
+            raise OpenRouterError(f'AI service error: {status_code} - {error_message}', status_code)
+
+        data = _json_loads(content)
+        
+        # Make sure we actually got a response from the AI
+        if not data.get('choices') or len(data['choices']) == 0:
+            raise Exception('The AI model did not generate a response. This might be due to content filtering or a temporary service issue.')
+
+        return ChatResponse(
+            content=data['choices'][0]['message']['content'],
+            usage=data.get('usage')  # Track token usage for monitoring
+        )
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        return self._async_clients.get()
 
-    def chat(self, messages: List[ChatMessage]) -> ChatResponse:
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            self._semaphores = {other: sem for other, sem in self._semaphores.items() if not other.is_closed()}
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        return semaphore
+
+    async def aclose(self) -> None:
+        """Close the pooled connections to OpenRouter"""
+        await self._async_clients.aclose()
+
+    def _fits_context(self, messages: List[ChatMessage]) -> bool:
+        """Whether the prompt plus the longest possible answer fits in the model's context"""
+        budget = self.CONTEXT_LIMIT - self.MAX_TOKENS
+        # A byte-level BPE token always covers at least one UTF-8 byte, so prompts
+        # with no more bytes than the budget can't be over it and skip the tokenizer
+        if sum(len(msg.content.encode('utf-8')) for msg in messages) <= budget:
+            return True
+        return count_tokens(messages) <= budget
+
+    def _check_prompt_size(self, messages: List[ChatMessage]) -> None:
+        if not self._fits_context(messages):
+            raise Exception(
+                f'The request is too long for the AI model (over {self.CONTEXT_LIMIT - self.MAX_TOKENS} tokens). '
+                'Please try a shorter question or fewer sources.'
+            )
+
+    async def chat(self, messages: List[ChatMessage]) -> ChatResponse:
         """
         Send our research query to the AI and get back a synthesized answer.
         
@@ -82,6 +268,9 @@ class OpenRouterClient:
         along with the user's question, and the AI reads through everything
         to give us a comprehensive, well-researched response.
         
+        Awaiting this frees the event loop while the model is thinking, so
+        other users' searches keep moving instead of queueing up behind us.
+        
         Args:
             messages: List of ChatMessage objects forming our conversation
             
@@ -92,66 +281,143 @@ class OpenRouterClient:
             Exception: If the AI service is unavailable or returns an error
         """
         try:
-            response = requests.post(
-                f'{self.base_url}/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {self.api_key}',
-                    'Content-Type': 'application/json',
-                    'HTTP-Referer': os.getenv('APP_URL', 'http://localhost:7860'),
-                    'X-Title': 'AI Research Assistant - Powered by DeepSeek V3'
-                },
-                json={
-                    'model': self.model,
-                    'messages': [{'role': msg.role, 'content': msg.content} for msg in messages],
-                    'temperature': 0.2,    # Lower temperature for more focused, factual responses
-                    'max_tokens': 4000,    # Generous limit for comprehensive answers
-                    'stream': False,       # Get the complete response at once
-                    'top_p': 0.9,         # Slight randomness to keep responses natural
-                    'frequency_penalty': 0.1,  # Reduce repetition
-                    'presence_penalty': 0.1    # Encourage diverse vocabulary
-                }
-            )
-
-            # Check if the AI service responded successfully
-            if not response.ok:
-                error_data = response.json() if response.content else {}
-                error_message = error_data.get('error', {}).get('message', 'Unknown error occurred')
-                raise Exception(f'AI service error: {response.status_code} - {error_message}')
-
-            data = response.json()
-            
-            # Make sure we actually got a response from the AI
-            if not data.get('choices') or len(data['choices']) == 0:
-                raise Exception('The AI model did not generate a response. This might be due to content filtering or a temporary service issue.')
-
-            return ChatResponse(
-                content=data['choices'][0]['message']['content'],
-                usage=data.get('usage')  # Track token usage for monitoring
-            )
+            self._check_prompt_size(messages)
+            response = await self._get_async_client().post('/chat/completions', content=_json_dumps(self._payload(messages)))
+            return self._parse_response(response.is_success, response.status_code, response.content)
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             # Handle network-related errors
             raise Exception(f'Network error while connecting to AI service: {str(e)}')
         except Exception as error:
             print(f'OpenRouter API error: {error}')
             raise error
 
-    def synthesize_search_results(self, query: str, search_results: List[Any]) -> str:
+    async def _chat_one(self, messages: List[ChatMessage]) -> ChatResponse:
+        """chat() that waits for a free slot and backs off on rate limits"""
+        async with self._get_semaphore():
+            for attempt in range(self.MAX_RETRIES + 1):
+                try:
+                    return await self.chat(messages)
+                except OpenRouterError as error:
+                    if error.status_code != 429 or attempt == self.MAX_RETRIES:
+                        raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def chat_many(self, conversations: List[List[ChatMessage]]) -> List[ChatResponse]:
         """
-        Transform raw search results into a comprehensive, well-researched answer.
+        Send several independent conversations to the AI at the same time.
         
-        This is where our app really shines! We take all the information we've
-        gathered from various sources and ask our AI to read through it all,
-        identify the key insights, resolve any contradictions, and present
-        everything in a clear, engaging way.
+        Handy when a question is broken into sub-questions: instead of waiting
+        for each answer in turn, they all run concurrently (at most
+        MAX_CONCURRENT_REQUESTS at once, to stay within OpenRouter's limits).
         
         Args:
-            query: The user's original research question
-            search_results: List of SearchResult objects with source information
+            conversations: One list of ChatMessage objects per request
             
         Returns:
-            A comprehensive answer with proper citations and analysis
+            The responses, in the same order as the conversations
+        """
+        return list(await asyncio.gather(*(self._chat_one(messages) for messages in conversations)))
+
+    async def chat_batch(self, prompts: List[str], system_prompt: str) -> List[str]:
         """
+        Answer several independent prompts with a single request.
+        
+        The prompts are packed into one user message as numbered tasks and the
+        model is asked to reply with matching numbered answers, which we split
+        back apart. Compared to one request per prompt, the system prompt is
+        only sent (and billed) once and we make a single round trip.
+        
+        Args:
+            prompts: The questions or tasks to answer
+            system_prompt: Instructions shared by all of them
+            
+        Returns:
+            One answer per prompt, in order ('' if the model skipped one)
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            response = await self.chat([
+                ChatMessage(role='system', content=system_prompt),
+                ChatMessage(role='user', content=prompts[0])
+            ])
+            return [response.content]
+        
+        tasks = '\n\n'.join(f'### Task {index}:\n{prompt}' for index, prompt in enumerate(prompts, 1))
+        user_prompt = (
+            f'Complete each of the following {len(prompts)} tasks independently.\n\n{tasks}\n\n'
+            'Reply with one section per task, in order, each starting on its own line '
+            'with "### Answer N:" where N is the task number.'
+        )
+        response = await self.chat([
+            ChatMessage(role='system', content=system_prompt),
+            ChatMessage(role='user', content=user_prompt)
+        ])
+        
+        answers = [''] * len(prompts)
+        parts = _ANSWER_SPLIT_RE.split(response.content)
+        for number, answer in zip(parts[1::2], parts[2::2]):
+            index = int(number) - 1
+            if 0 <= index < len(answers):
+                answers[index] = answer.strip()
+        return answers
+
+    async def chat_stream(self, messages: List[ChatMessage], usage: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+        """
+        Stream the AI's answer as it's being written.
+        
+        Instead of waiting for the whole response, we ask OpenRouter for
+        server-sent events and hand back each piece of text as soon as it
+        arrives, so users can start reading within a second or so.
+        
+        Args:
+            messages: List of ChatMessage objects forming our conversation
+            usage: Optional dict that gets filled with the token usage stats
+                   OpenRouter sends along with the final piece
+            
+        Yields:
+            Pieces of the AI's answer, in order
+        """
+        try:
+            self._check_prompt_size(messages)
+            async with self._get_async_client().stream(
+                'POST', '/chat/completions', content=_json_dumps(self._payload(messages, stream=True))
+            ) as response:
+                if not response.is_success:
+                    await response.aread()
+                    self._parse_response(False, response.status_code, response.content)
+                
+                async for line in response.aiter_lines():
+                    # Skip keep-alive comments and blank separator lines
+                    if not line.startswith('data: '):
+                        continue
+                    data = line[6:]
+                    if data == '[DONE]':
+                        break
+                    
+                    chunk = _json_loads(data)
+                    if 'error' in chunk:
+                        raise Exception(f"AI service error: {chunk['error'].get('message', 'Unknown error occurred')}")
+                    
+                    if usage is not None and chunk.get('usage'):
+                        usage.update(chunk['usage'])
+                    
+                    choices = chunk.get('choices')
+                    if choices:
+                        content = choices[0].get('delta', {}).get('content')
+                        if content:
+                            yield content
+            
+        except httpx.HTTPError as e:
+            # Handle network-related errors
+            raise Exception(f'Network error while connecting to AI service: {str(e)}')
+        except Exception as error:
+            print(f'OpenRouter API error: {error}')
+            raise error
+
+    def _synthesis_messages(self, query: str, search_results: List[Any]) -> List[ChatMessage]:
+        """Build the system and user prompts for synthesizing search results"""
         # Craft a detailed system prompt that guides the AI to be helpful and accurate
         system_prompt = """You are an expert research assistant with a talent for synthesizing information from multiple sources into clear, comprehensive answers.
 
@@ -173,29 +439,156 @@ When synthesizing information:
 
 Remember: Your goal is to save the reader time while giving them confidence in the information and the ability to dive deeper if they want."""
 
-        # Prepare the search context in a clear, structured format
-        search_context = '\n'.join([
-            f"[{index + 1}] {result.title}\nSource: {result.domain}\nURL: {result.url}\nContent: {result.snippet}\n"
-            for index, result in enumerate(search_results)
-        ])
+        # Prepare the search context in a clear, structured format. Snippets are
+        # capped to keep the prompt small, and repeats of the same page are
+        # skipped (numbers stay as-is so [n] still matches the sources list).
+        seen = set()
+        sources = []
+        for index, result in enumerate(search_results, 1):
+            if (result.domain, result.title) in seen:
+                continue
+            seen.add((result.domain, result.title))
+            sources.append(_SOURCE_FMT(index, result.title, result.domain, result.url, result.snippet[:_MAX_SNIPPET_CHARS]))
+
+        def build_messages() -> List[ChatMessage]:
+            search_context = '\n'.join(sources)
 
-        # Create a detailed user prompt that gives the AI everything it needs
-        user_prompt = f"""Research Question: {query}
+            # Create a detailed user prompt that gives the AI everything it needs
+            user_prompt = f"""Research Question: {query}
 
 Sources Found:
 {search_context}
 
 Please provide a comprehensive, well-researched answer based on these sources. Structure your response to be informative and engaging, with proper citations using [1], [2], etc. format. If sources present different perspectives, acknowledge them. Focus on accuracy and clarity while maintaining a conversational tone."""
 
-        # Send our carefully crafted messages to the AI
-        messages = [
-            ChatMessage(role='system', content=system_prompt),
-            ChatMessage(role='user', content=user_prompt)
-        ]
+            return [
+                ChatMessage(role='system', content=system_prompt),
+                ChatMessage(role='user', content=user_prompt)
+            ]
 
-        response = self.chat(messages)
+        # If everything doesn't fit in the model's context, drop the
+        # lowest-ranked sources until it does
+        messages = build_messages()
+        while len(sources) > 1 and not self._fits_context(messages):
+            sources.pop()
+            messages = build_messages()
+        return messages
+
+    async def synthesize_search_results(self, query: str, search_results: List[Any]) -> str:
+        """
+        Transform raw search results into a comprehensive, well-researched answer.
+        
+        This is where our app really shines! We take all the information we've
+        gathered from various sources and ask our AI to read through it all,
+        identify the key insights, resolve any contradictions, and present
+        everything in a clear, engaging way.
+        
+        Args:
+            query: The user's original research question
+            search_results: List of SearchResult objects with source information
+            
+        Returns:
+            A comprehensive answer with proper citations and analysis
+        """
+        key = self._synthesis_key(query, search_results)
+        cached = self._cached_synthesis(key)
+        if cached is not None:
+            return cached
+        
+        response = await self.chat(self._synthesis_messages(query, search_results))
+        self._cache_synthesis(key, response.content)
         return response.content
 
+    async def synthesize_search_results_stream(self, query: str, search_results: List[Any],
+                                               usage: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+        """
+        Same as synthesize_search_results(), but yields the answer piece by
+        piece as the AI writes it.
+        """
+        key = self._synthesis_key(query, search_results)
+        cached = self._cached_synthesis(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        parts = []
+        async for content in self.chat_stream(self._synthesis_messages(query, search_results), usage):
+            parts.append(content)
+            yield content
+        self._cache_synthesis(key, ''.join(parts))
+
+    @staticmethod
+    def _synthesis_key(query: str, search_results: List[Any]) -> Tuple[str, Tuple[str, ...]]:
+        return ' '.join(query.lower().split()), tuple(result.url for result in search_results)
+
+    def _cached_synthesis(self, key: Tuple[str, Tuple[str, ...]]) -> Optional[str]:
+        answer = self._synthesis_cache.get(key)
+        if answer is not None:
+            self._synthesis_cache.move_to_end(key)
+        return answer
+
+    def _cache_synthesis(self, key: Tuple[str, Tuple[str, ...]], answer: str) -> None:
+        if not answer:
+            return
+        self._synthesis_cache[key] = answer
+        self._synthesis_cache.move_to_end(key)
+        if len(self._synthesis_cache) > self.SYNTHESIS_CACHE_SIZE:
+            self._synthesis_cache.popitem(last=False)
+
+async def buffered_stream(stream: AsyncIterator[str], maxsize: int = 128) -> AsyncIterator[str]:
+    """
+    Read a token stream in a background task and hand the tokens over through
+    a bounded queue.
+    
+    This keeps the HTTP connection draining at network speed even while the
+    consumer is busy (say, waiting for the UI to render), instead of the
+    socket stalling whenever the UI does. Errors from the stream are re-raised
+    to the consumer, and stopping early cancels the reader.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    end = object()
+    
+    async def pump():
+        try:
+            async for token in stream:
+                await queue.put(token)
+        except Exception as error:
+            await queue.put(error)
+        else:
+            await queue.put(end)
+    
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        reader.cancel()
+
+async def coalesce_stream(stream: AsyncIterator[str], min_chars: int = 40) -> AsyncIterator[str]:
+    """
+    Regroup a token stream into pieces of at least `min_chars` characters.
+    
+    Models send a handful of characters per event; UIs that re-render on every
+    update do much better with fewer, bigger pieces. Whatever is left at the
+    end is flushed as-is.
+    """
+    buffer = []
+    size = 0
+    async for token in stream:
+        buffer.append(token)
+        size += len(token)
+        if size >= min_chars:
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
 # Global client instance for efficient resource usage
 _openrouter_client = None
 
@@ -227,5 +620,11 @@ def get_openrouter_client() -> OpenRouterClient:
             )
             
         _openrouter_client = OpenRouterClient(api_key)
+        atexit.register(_close_openrouter_client)
         
-    return _openrouter_client
\ No newline at end of file
+    return _openrouter_client
+
+def _close_openrouter_client() -> None:
+    """Shut down the shared client's keep-alive connections when the app exits"""
+    if _openrouter_client is not None:
+        _openrouter_client._async_clients.close()
\ No newline at end of file
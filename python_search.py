@@ -19,10 +19,15 @@ Features:
 - Async support for smooth user experience
 """
 
+import os
 import time
 import asyncio
-from typing import List, Dict, Any
+import functools
+from typing import List, Dict, Any, Tuple
+from urllib.parse import urlsplit
+from dataclasses import dataclass
 
+@dataclass(slots=True, frozen=True)
 class SearchResult:
     """
     Represents a single search result from our web search.
@@ -34,22 +39,16 @@ class SearchResult:
     It's designed to be simple but comprehensive, giving users all the
     context they need to understand and potentially visit the source.
     """
+    title: str    # The headline or title of the article/page
+    url: str      # The full web address where this content lives
+    snippet: str  # A brief excerpt that gives you the gist of the content
+    domain: str   # The website name (like 'nasa.gov' or 'bbc.com'); taken from
+                  # the URL if empty. A leading 'www.' is dropped either way.
     
-    def __init__(self, title: str, url: str, snippet: str, domain: str):
-        """
-        Create a new search result.
-        
-        Args:
-            title: The headline or title of the article/page
-            url: The full web address where this content lives
-            snippet: A brief excerpt that gives you the gist of the content
-            domain: The website name (like 'nasa.gov' or 'bbc.com')
-        """
-        self.title = title
-        self.url = url
-        self.snippet = snippet
-        self.domain = domain
+    def __post_init__(self):
+        object.__setattr__(self, 'domain', (self.domain or urlsplit(self.url).netloc).removeprefix('www.'))
 
+@dataclass(slots=True, frozen=True)
 class SearchResponse:
     """
     A collection of search results, like a basket full of research findings.
@@ -60,92 +59,123 @@ class SearchResponse:
     
     It's the container that holds all our detective work!
     """
-    
-    def __init__(self, results: List[SearchResult], total_results: int):
-        """
-        Create a new search response.
-        
-        Args:
-            results: List of SearchResult objects we found
-            total_results: Total number of results available (might be more than we return)
-        """
-        self.results = results
-        self.total_results = total_results
+    results: List[SearchResult]  # The SearchResult objects we found
+    total_results: int           # Total number of results available (might be more than we return)
 
-# Comprehensive mock search database for demonstration
+# Comprehensive mock search database for demonstration, kept as plain data
+# until a search actually falls back to it.
 # In a real application, this would be replaced by actual API calls
-mock_search_results = {
+_MOCK_JSON = {
     # Climate and environmental topics
     "climate change": [
-        SearchResult(
-            title="Climate Change Evidence and Impacts | NASA",
-            url="https://climate.nasa.gov/effects/",
-            snippet="Climate change is causing measurable changes to Earth's systems. Scientists have been tracking these changes for decades, documenting rising temperatures, melting ice sheets, and changing precipitation patterns that affect every corner of our planet.",
-            domain="climate.nasa.gov"
-        ),
-        SearchResult(
-            title="What is Climate Change? | United Nations",
-            url="https://www.un.org/en/climatechange/what-is-climate-change",
-            snippet="Climate change refers to long-term shifts in temperatures and weather patterns. While climate changes may be natural, since the 1800s, human activities have been the main driver of climate change, primarily due to burning fossil fuels.",
-            domain="un.org"
-        ),
-        SearchResult(
-            title="Climate Change Impacts on Human Health | EPA",
-            url="https://www.epa.gov/climate-impacts",
-            snippet="Climate change impacts human health and wellbeing through more extreme weather events and wildfires, decreased air quality, and diseases transmitted by insects, food, and water. Understanding these connections helps us prepare and adapt.",
-            domain="epa.gov"
-        )
+        {
+            "title": "Climate Change Evidence and Impacts | NASA",
+            "url": "https://climate.nasa.gov/effects/",
+            "snippet": "Climate change is causing measurable changes to Earth's systems. Scientists have been tracking these changes for decades, documenting rising temperatures, melting ice sheets, and changing precipitation patterns that affect every corner of our planet.",
+            "domain": "climate.nasa.gov"
+        },
+        {
+            "title": "What is Climate Change? | United Nations",
+            "url": "https://www.un.org/en/climatechange/what-is-climate-change",
+            "snippet": "Climate change refers to long-term shifts in temperatures and weather patterns. While climate changes may be natural, since the 1800s, human activities have been the main driver of climate change, primarily due to burning fossil fuels.",
+            "domain": "un.org"
+        },
+        {
+            "title": "Climate Change Impacts on Human Health | EPA",
+            "url": "https://www.epa.gov/climate-impacts",
+            "snippet": "Climate change impacts human health and wellbeing through more extreme weather events and wildfires, decreased air quality, and diseases transmitted by insects, food, and water. Understanding these connections helps us prepare and adapt.",
+            "domain": "epa.gov"
+        }
     ],
     # Artificial Intelligence and technology topics
     "artificial intelligence": [
-        SearchResult(
-            title="What is Artificial Intelligence (AI)? | IBM",
-            url="https://www.ibm.com/topics/artificial-intelligence",
-            snippet="Artificial intelligence leverages computers and machines to mimic the problem-solving and decision-making capabilities of the human mind. Modern AI systems can learn, reason, and even understand natural language in ways that seemed impossible just decades ago.",
-            domain="ibm.com"
-        ),
-        SearchResult(
-            title="Artificial Intelligence Research | Stanford HAI",
-            url="https://hai.stanford.edu/what-ai",
-            snippet="AI is a broad field of computer science concerned with building smart machines capable of performing tasks that typically require human intelligence. From healthcare to transportation, AI is revolutionizing how we solve complex problems.",
-            domain="stanford.edu"
-        ),
-        SearchResult(
-            title="The Future of AI: Trends and Predictions for 2025",
-            url="https://www.weforum.org/agenda/2025/ai-trends",
-            snippet="As we move through 2025, artificial intelligence continues to evolve rapidly. From generative AI to autonomous systems, we're seeing unprecedented advances that are reshaping industries and creating new possibilities for human-AI collaboration.",
-            domain="weforum.org"
-        )
+        {
+            "title": "What is Artificial Intelligence (AI)? | IBM",
+            "url": "https://www.ibm.com/topics/artificial-intelligence",
+            "snippet": "Artificial intelligence leverages computers and machines to mimic the problem-solving and decision-making capabilities of the human mind. Modern AI systems can learn, reason, and even understand natural language in ways that seemed impossible just decades ago.",
+            "domain": "ibm.com"
+        },
+        {
+            "title": "Artificial Intelligence Research | Stanford HAI",
+            "url": "https://hai.stanford.edu/what-ai",
+            "snippet": "AI is a broad field of computer science concerned with building smart machines capable of performing tasks that typically require human intelligence. From healthcare to transportation, AI is revolutionizing how we solve complex problems.",
+            "domain": "stanford.edu"
+        },
+        {
+            "title": "The Future of AI: Trends and Predictions for 2025",
+            "url": "https://www.weforum.org/agenda/2025/ai-trends",
+            "snippet": "As we move through 2025, artificial intelligence continues to evolve rapidly. From generative AI to autonomous systems, we're seeing unprecedented advances that are reshaping industries and creating new possibilities for human-AI collaboration.",
+            "domain": "weforum.org"
+        }
     ],
     # Software engineering and job market topics
     "software engineering job market 2025": [
-        SearchResult(
-            title="State of the Software Engineering Job Market in 2025",
-            url="https://newsletter.pragmaticengineer.com/p/software-engineering-job-market-2025",
-            snippet="The 2025 job market for software engineering is stabilizing after recent turbulence, but it remains highly competitive and focuses more on experienced and specialized talent, especially in AI, cloud, and infrastructure roles. Companies are being more selective but opportunities exist for skilled developers.",
-            domain="newsletter.pragmaticengineer.com"
-        ),
-        SearchResult(
-            title="Software Engineer Job Market 2025: Recovery in Sight?",
-            url="https://distantjob.com/blog/software-engineer-job-market-2025/",
-            snippet="Job openings remain below pre-pandemic highs, but the market is seeing a gradual rebound, with current openings about 37% higher than their lowest point in recent years. Remote work opportunities continue to expand, giving developers more flexibility than ever.",
-            domain="distantjob.com"
-        ),
-        SearchResult(
-            title="Tech Industry Hiring: What's Really Happening in 2025",
-            url="https://www.linkedin.com/pulse/tech-hiring-reality-2025",
-            snippet="The industry is roughly 22% smaller than it was in early 2022, with slow recovery and ongoing caution in hiring. However, certain specializations like AI/ML, cybersecurity, and cloud architecture are seeing strong demand and competitive salaries.",
-            domain="linkedin.com"
-        ),
-        SearchResult(
-            title="Software Developer Salary and Demand Trends (2025)",
-            url="https://stackoverflow.blog/2025/developer-trends",
-            snippet="Software development roles continue to be in demand, but companies are more selective and prioritizing senior developers with specialized skills. The rise of AI tools is changing how developers work, but creating new opportunities rather than replacing jobs.",
-            domain="stackoverflow.blog"
-        )
+        {
+            "title": "State of the Software Engineering Job Market in 2025",
+            "url": "https://newsletter.pragmaticengineer.com/p/software-engineering-job-market-2025",
+            "snippet": "The 2025 job market for software engineering is stabilizing after recent turbulence, but it remains highly competitive and focuses more on experienced and specialized talent, especially in AI, cloud, and infrastructure roles. Companies are being more selective but opportunities exist for skilled developers.",
+            "domain": "newsletter.pragmaticengineer.com"
+        },
+        {
+            "title": "Software Engineer Job Market 2025: Recovery in Sight?",
+            "url": "https://distantjob.com/blog/software-engineer-job-market-2025/",
+            "snippet": "Job openings remain below pre-pandemic highs, but the market is seeing a gradual rebound, with current openings about 37% higher than their lowest point in recent years. Remote work opportunities continue to expand, giving developers more flexibility than ever.",
+            "domain": "distantjob.com"
+        },
+        {
+            "title": "Tech Industry Hiring: What's Really Happening in 2025",
+            "url": "https://www.linkedin.com/pulse/tech-hiring-reality-2025",
+            "snippet": "The industry is roughly 22% smaller than it was in early 2022, with slow recovery and ongoing caution in hiring. However, certain specializations like AI/ML, cybersecurity, and cloud architecture are seeing strong demand and competitive salaries.",
+            "domain": "linkedin.com"
+        },
+        {
+            "title": "Software Developer Salary and Demand Trends (2025)",
+            "url": "https://stackoverflow.blog/2025/developer-trends",
+            "snippet": "Software development roles continue to be in demand, but companies are more selective and prioritizing senior developers with specialized skills. The rise of AI tools is changing how developers work, but creating new opportunities rather than replacing jobs.",
+            "domain": "stackoverflow.blog"
+        }
     ]
 }
 
+@functools.cache
+def _get_mock_db() -> Dict[str, Tuple[SearchResult, ...]]:
+    """Build the SearchResult objects for the mock database the first time they're needed"""
+    return {
+        keyword: tuple(SearchResult(**entry) for entry in entries)
+        for keyword, entries in _MOCK_JSON.items()
+    }
+
+# Seconds of fake network latency to add to each mock search (MOCK_SEARCH_DELAY
+# env var, e.g. 1.2 for demos). Off by default.
+_MOCK_SEARCH_DELAY = float(os.getenv("MOCK_SEARCH_DELAY", "0"))
+
+# Generic results used when no mock data matches the query:
+# (title, url, snippet, domain), where {q} is the query, {d}/{u} are the
+# query with spaces turned into dashes/underscores and {dl} is {d} lowercased
+_FALLBACK = (
+    (
+        'Comprehensive Research on "{q}"',
+        "https://research.example.com/topics/{dl}",
+        "This is a simulated search result for your query about {q}. In a live version of this app, this would be replaced with real, up-to-date information from authoritative sources across the web. Our AI would then analyze these real sources to give you accurate, well-researched answers.",
+        "research.example.com"
+    ),
+    (
+        "{q} - Latest Updates and Analysis",
+        "https://news.example.com/articles/{d}",
+        "Stay informed about the latest developments in {q}. This mock result demonstrates how our search system would find current news, expert analysis, and authoritative sources to help answer your questions with the most recent and relevant information available.",
+        "news.example.com"
+    ),
+    (
+        "Expert Guide: Understanding {q}",
+        "https://guides.example.com/{u}",
+        "A comprehensive expert guide covering everything you need to know about {q}. Our search system prioritizes authoritative, well-researched sources to ensure you get accurate, trustworthy information for your research needs.",
+        "guides.example.com"
+    ),
+)
+
+# Keywords to look for in queries, longest first
+_KEYWORDS = tuple(sorted(_MOCK_JSON, key=len, reverse=True))
+
 async def search_web(query: str) -> SearchResponse:
     """
     Simulate a comprehensive web search with intelligent mock results.
@@ -169,43 +199,35 @@ async def search_web(query: str) -> SearchResponse:
         >>> print(f"Found {len(results.results)} sources")
         Found 3 sources
     """
-    # Simulate the time it takes to search the web
+    # Optionally simulate the time it takes to search the web
     # In real life, this is when we'd be making API calls
-    await asyncio.sleep(1.2)
+    if _MOCK_SEARCH_DELAY:
+        await asyncio.sleep(_MOCK_SEARCH_DELAY)
     
     query_lower = query.lower()
     results = []
     
     # Smart keyword matching - look for the most relevant mock data
     # This mimics how a real search engine would match user queries
-    # to relevant content based on keywords and topics
-    for keyword, mock_results in mock_search_results.items():
-        if keyword in query_lower:
-            results.extend(mock_results)
-            break  # Use the first match for more focused results
+    # to relevant content based on keywords and topics. The most specific
+    # (longest) matching keyword wins, for more focused results.
+    keyword = next((k for k in _KEYWORDS if k in query_lower), None)
+    if keyword is not None:
+        results.extend(_get_mock_db()[keyword])
     
     # If we don't have specific mock data, create generic but helpful results
     # This ensures users always get something useful, even for unexpected queries
     if not results:
+        slug_dash = query.replace(' ', '-')
+        slug_under = query.replace(' ', '_')
         results = [
             SearchResult(
-                title=f"Comprehensive Research on \"{query}\"",
-                url=f"https://research.example.com/topics/{query.replace(' ', '-').lower()}",
-                snippet=f"This is a simulated search result for your query about {query}. In a live version of this app, this would be replaced with real, up-to-date information from authoritative sources across the web. Our AI would then analyze these real sources to give you accurate, well-researched answers.",
-                domain="research.example.com"
-            ),
-            SearchResult(
-                title=f"{query} - Latest Updates and Analysis",
-                url=f"https://news.example.com/articles/{query.replace(' ', '-')}",
-                snippet=f"Stay informed about the latest developments in {query}. This mock result demonstrates how our search system would find current news, expert analysis, and authoritative sources to help answer your questions with the most recent and relevant information available.",
-                domain="news.example.com"
-            ),
-            SearchResult(
-                title=f"Expert Guide: Understanding {query}",
-                url=f"https://guides.example.com/{query.replace(' ', '_')}",
-                snippet=f"A comprehensive expert guide covering everything you need to know about {query}. Our search system prioritizes authoritative, well-researched sources to ensure you get accurate, trustworthy information for your research needs.",
-                domain="guides.example.com"
+                title=title.format(q=query),
+                url=url.format(d=slug_dash, dl=slug_dash.lower(), u=slug_under),
+                snippet=snippet.format(q=query),
+                domain=domain
             )
+            for title, url, snippet, domain in _FALLBACK
         ]
     
     # Return up to 8 results for optimal user experience
@@ -5,28 +5,31 @@ Mini version of SurfSense that uses the web as database and can analyze document
 """
 
 import gradio as gr
+import asyncio
 import os
 import re
 import time
+from html import escape
 from dotenv import load_dotenv
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 
 # Load environment variables
 load_dotenv()
 
 # Import our RAG modules
 from vector_store import get_rag_system
-from python_openrouter import get_openrouter_client, ChatMessage
+from python_openrouter import get_openrouter_client, ChatMessage, coalesce_stream
+from ui_helpers import AnswerCache, minify_css
 
 # =============================
 # Custom CSS (Improved Layout)
 # =============================
 custom_css = """
-@import url('https://fonts.googleapis.com/css2?family=Segoe+UI:wght@300;400;500;600;700&display=swap');
-@import url('https://fonts.googleapis.com/css2?family=Helvetica:wght@300;400;500;600;700&display=swap');
 
+/* Segoe UI isn't a Google Font, so rather than importing it (a blocking request
+   that never returns a font) we use whatever system font is installed locally. */
 * {
-    font-family: 'Segoe UI', -apple-system, BlinkMacSystemFont, sans-serif !important;
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif !important;
 }
 
 body, .gradio-container {
@@ -92,7 +95,7 @@ input, textarea {
     font-size: 15px !important;
     flex: 1;
     min-width: 650px; /* wider */
-    font-family: 'Segoe UI', sans-serif !important;
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif !important;
 }
 
 input:focus, textarea:focus {
@@ -354,7 +357,7 @@ input::placeholder, textarea::placeholder {
     padding: 12px 20px !important;
     border-bottom: 2px solid transparent !important;
     transition: all 0.2s ease !important;
-    font-family: 'Segoe UI', sans-serif !important;
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif !important;
 }
 
 .tab-nav button.selected {
@@ -426,149 +429,185 @@ input::placeholder, textarea::placeholder {
 }
 """
 
+# Minified once at import; Gradio sends this with every page load
+custom_css = minify_css(custom_css)
+
 # =============================
 # RAG Logic
 # =============================
 
-def format_web_response(query: str, web_results: List, ai_response: str) -> Tuple[str, str, str]:
-    """Format web-only results with enhanced text formatting to match Perplexity-style output"""
-    
-    import re
-    
-    # Clean up citation numbers first
-    formatted_response = ai_response.strip()
-    
-    # Remove citation numbers like [1], [2], [3][7], etc.
-    formatted_response = re.sub(r'\[\d+\](?:\[\d+\])*', '', formatted_response)
-    
-    # Clean up any double spaces left after removing citations
-    formatted_response = re.sub(r'\s+', ' ', formatted_response)
-    
-    # Convert markdown headers to HTML with proper hierarchy
-    formatted_response = re.sub(r'^### (.+?)$', r'<h3>\1</h3>', formatted_response, flags=re.MULTILINE)
-    formatted_response = re.sub(r'^## (.+?)$', r'<h2>\1</h2>', formatted_response, flags=re.MULTILINE) 
-    formatted_response = re.sub(r'^# (.+?)$', r'<h1>\1</h1>', formatted_response, flags=re.MULTILINE)
-    
-    # Handle inline headers that weren't caught
-    formatted_response = re.sub(r'\s###\s(.+?)(?=\s|$)', r'<h3>\1</h3>', formatted_response)
+# Inline markup patterns, compiled once
+_CITATION_RE = re.compile(r'\[\d+\](?:\[\d+\])*')
+_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
+_EM_RE = re.compile(r'\*(.+?)\*')
+
+_HEADER_TAGS = {'#': 'h1', '##': 'h2', '###': 'h3'}
+_BULLETS = ('- ', '* ', '• ')
+
+def _inline_markup(text: str) -> str:
+    """Bold and italics for a single block of text"""
+    if '*' not in text:
+        return text
+    return _EM_RE.sub(r'<em>\1</em>', _BOLD_RE.sub(r'<strong>\1</strong>', text))
+
+def _markdown_to_html(markdown: str) -> str:
+    """
+    Convert the model's markdown answer to HTML in a single pass over its lines.
     
-    # Convert markdown formatting
-    formatted_response = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', formatted_response)
-    formatted_response = re.sub(r'\*(.+?)\*', r'<em>\1</em>', formatted_response)
+    Handles headers, bullet lists and paragraphs (consecutive text lines),
+    plus bold/italic inside each block. Citation numbers like [1] or [3][7]
+    are removed.
+    """
+    blocks = []      # finished HTML blocks
+    paragraph = []   # lines of the paragraph being collected
+    items = []       # items of the bullet list being collected
     
-    # Handle bullet points with improved logic
-    # First, find and mark bullet point lines
-    lines = formatted_response.split('\n')
-    processed_lines = []
-    in_list = False
+    def flush():
+        if paragraph:
+            blocks.append(f'<p>{_inline_markup(" ".join(paragraph))}</p>')
+            paragraph.clear()
+        if items:
+            blocks.append('<ul>\n' + '\n'.join(f'<li>{_inline_markup(item)}</li>' for item in items) + '\n</ul>')
+            items.clear()
     
-    for line in lines:
-        line = line.strip()
+    for line in _CITATION_RE.sub('', markdown).splitlines():
+        line = ' '.join(line.split())
         if not line:
-            if in_list:
-                processed_lines.append('</ul>')
-                in_list = False
-            processed_lines.append('')
+            flush()
             continue
-            
-        # Check if this is a bullet point
-        bullet_match = re.match(r'^[-*•]\s+(.+)$', line)
-        if bullet_match:
-            if not in_list:
-                processed_lines.append('<ul>')
-                in_list = True
-            processed_lines.append(f'<li>{bullet_match.group(1)}</li>')
-        else:
-            if in_list:
-                processed_lines.append('</ul>')
-                in_list = False
-            processed_lines.append(line)
-    
-    # Close any open list
-    if in_list:
-        processed_lines.append('</ul>')
-    
-    # Rejoin lines
-    formatted_response = '\n'.join(processed_lines)
-    
-    # Smart paragraph handling - split by double newlines and headers
-    parts = re.split(r'(<h[123]>.*?</h[123]>|<ul>.*?</ul>)', formatted_response, flags=re.DOTALL)
-    
-    processed_parts = []
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-            
-        # Keep headers and lists as-is
-        if re.match(r'^<(h[123]|ul)>', part):
-            processed_parts.append(part)
+        
+        # Plain character checks only: one dict lookup for headers (and only
+        # on lines that start with '#'), one startswith for bullets
+        marker, _, text = line.partition(' ') if line[0] == '#' else ('', '', '')
+        tag = _HEADER_TAGS.get(marker)
+        if tag and text:
+            flush()
+            blocks.append(f'<{tag}>{_inline_markup(text)}</{tag}>')
+        elif line.startswith(_BULLETS):
+            if paragraph:
+                flush()
+            items.append(line[2:].lstrip())
         else:
-            # Split text into logical paragraphs
-            paragraphs = re.split(r'\n\s*\n', part)
-            for para in paragraphs:
-                para = para.strip()
-                if para and not re.match(r'^<(h[123]|ul|li)', para):
-                    processed_parts.append(f'<p>{para}</p>')
-                elif para:
-                    processed_parts.append(para)
-    
-    # Join with proper spacing
-    formatted_response = '\n\n'.join(processed_parts)
-    
-    # Final cleanup
-    formatted_response = re.sub(r'\n\s*\n', '\n\n', formatted_response)
+            if items:
+                flush()
+            paragraph.append(line)
+    flush()
     
-    answer_html = f"""
+    return '\n\n'.join(blocks)
+
+def _trunc(text: str, limit: int) -> str:
+    """Cut text to `limit` characters, marking the cut with an ellipsis"""
+    return text if len(text) <= limit else text[:limit] + '…'
+
+# One card in the Sources tab
+_SOURCE_TMPL = """
+<div class="source-card">
+    <div style="display: flex; align-items: center; margin-bottom: 8px;">
+        <img src="https://www.google.com/s2/favicons?domain={domain}" 
+             width="16" height="16" loading="lazy" decoding="async"
+             style="margin-right: 8px; border-radius: 2px;" 
+             onerror="this.style.display='none'">
+        <a href="{url}" target="_blank" class="source-title" style="font-size: 14px; font-weight: 500;">{title}</a>
+    </div>
+    <div class="source-domain" style="font-size: 12px; color: #888; margin-bottom: 6px;">{domain}</div>
+    <div class="source-snippet" style="font-size: 13px; line-height: 1.4;">{snippet}</div>
+</div>
+"""
+
+def _answer_html(formatted_response: str) -> str:
+    """Wrap the converted answer for the Answer tab"""
+    return f"""
     <div class="content-hierarchy">
         {formatted_response}
     </div>
     """
 
-    # Enhanced source formatting matching Perplexity style
+class _StreamingAnswer:
+    """
+    Formats an answer that arrives in pieces without re-converting all of it.
+    
+    A blank line closes any open paragraph or list, so everything before the
+    last blank line is final: it's converted once and kept as HTML blocks, and
+    only the text after it is converted again on each update.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self._blocks = []   # HTML of the finished part of the answer
+        self._done = 0      # how many characters of text that covers
+    
+    def add(self, piece: str) -> str:
+        """Append a piece of the answer and return the HTML for all of it so far"""
+        self.text += piece
+        cut = self.text.rfind('\n\n', self._done)
+        if cut > self._done:
+            finished = _markdown_to_html(self.text[self._done:cut])
+            if finished:
+                self._blocks.append(finished)
+            self._done = cut
+        tail = _markdown_to_html(self.text[self._done:])
+        return _answer_html('\n\n'.join([*self._blocks, tail] if tail else self._blocks))
+
+def format_sources(web_results: List) -> str:
+    """Enhanced source formatting matching Perplexity style"""
     sources_html_parts = []
     for i, result in enumerate(web_results):
         # Clean and truncate titles
-        title = result.title[:70] + "..." if len(result.title) > 70 else result.title
-        snippet = result.snippet[:150] + "..." if len(result.snippet) > 150 else result.snippet
+        title = _trunc(result.title, 70)
+        snippet = _trunc(result.snippet, 150)
         
         # Extract domain for favicon
         domain = result.domain if hasattr(result, 'domain') else result.url.split('/')[2] if '/' in result.url else result.url
         
-        sources_html_parts.append(f"""
-        <div class="source-card">
-            <div style="display: flex; align-items: center; margin-bottom: 8px;">
-                <img src="https://www.google.com/s2/favicons?domain={domain}" 
-                     style="width: 16px; height: 16px; margin-right: 8px; border-radius: 2px;" 
-                     onerror="this.style.display='none'">
-                <a href="{result.url}" target="_blank" class="source-title" style="font-size: 14px; font-weight: 500;">{title}</a>
-            </div>
-            <div class="source-domain" style="font-size: 12px; color: #888; margin-bottom: 6px;">{domain}</div>
-            <div class="source-snippet" style="font-size: 13px; line-height: 1.4;">{snippet}</div>
-        </div>
-        """)
-
-    sources_html = f"""
-    <div class="sources-content">
-        {''.join(sources_html_parts) if sources_html_parts else "<p>No sources found.</p>"}
-    </div>
+        # Everything comes from third-party pages, so escape it before it goes into the HTML.
+        # (html.escape's chained str.replace calls run in C and beat a str.translate
+        # table by more than 10x on strings this short, so it stays.)
+        sources_html_parts.append(_SOURCE_TMPL.format(
+            domain=escape(domain),
+            url=escape(result.url),
+            title=escape(title),
+            snippet=escape(snippet),
+        ))
+
+    if not sources_html_parts:
+        return '<div class="sources-content"><p>No sources found.</p></div>'
+    return ''.join(['<div class="sources-content">', *sources_html_parts, '</div>'])
+
+
+# Recently answered questions, so repeated ones (like the example buttons) skip
+# search and synthesis
+_ANSWER_CACHE = AnswerCache(size=128, ttl=3600)
+
+async def search_web_only(query: str) -> AsyncIterator[Tuple[str, str, str]]:
+    """
+    Enhanced web search with more sources and parallel processing.
+    
+    The answer is streamed: each yield is the (answer, sources, extra) HTML for
+    everything the model has written so far.
     """
-
-    return answer_html, sources_html, ""
-
-
-def search_web_only(query: str) -> Tuple[str, str, str]:
-    """Enhanced web search with more sources and parallel processing"""
     if not query.strip():
-        return "Please enter a question.", "No sources.", ""
+        yield "Please enter a question.", "No sources.", ""
+        return
+
+    cache_key = _ANSWER_CACHE.key(query)
+    cached = _ANSWER_CACHE.get(cache_key)
+    if cached:
+        yield *cached, ""
+        return
 
     try:
         rag_system = get_rag_system()
         # Increased from 3 to 8 results for more comprehensive coverage
-        web_results = rag_system.search_web(query, n_results=8)
+        web_results = await rag_system.search_web(query, n_results=8)
         
         if not web_results:
-            return "No results found.", "", ""
+            yield "No results found.", "", ""
+            return
+        
+        # The sources don't depend on the answer, so show them straight away
+        # (and render them only once while the answer streams in)
+        sources_html = format_sources(web_results)
+        yield "", sources_html, ""
 
         # Enhanced context preparation with more content but optimized processing
         context_parts = []
@@ -607,22 +646,105 @@ Provide a comprehensive, well-structured answer that synthesizes insights from a
             ChatMessage(role="system", content=system_prompt),
             ChatMessage(role="user", content=user_prompt),
         ]
-        response = client.chat(messages)
-        ai_answer = response.content
-
-        return format_web_response(query, web_results, ai_answer)
+        # Re-render every ~50 tokens (about 200 characters) rather than per token
+        answer = _StreamingAnswer()
+        answer_html = ""
+        async for piece in coalesce_stream(client.chat_stream(messages), min_chars=200):
+            answer_html = answer.add(piece)
+            yield answer_html, sources_html, ""
+        
+        if answer.text.strip():
+            _ANSWER_CACHE.put(cache_key, answer_html, sources_html)
 
     except Exception as e:
-        return f"Error: {str(e)}", "", ""
+        yield f"Error: {str(e)}", "", ""
 
 
 # =============================
 # UI
 # =============================
 
+# Minimal loading animation with cycling text. The markup is the same for every
+# search, so it's a constant; the script that cycles the messages is installed
+# once in the page <head> (along with the example buttons' click handler) and
+# started from the browser when a search begins.
+_LOADING_HTML = """
+<div class="loading-container-minimal">
+    <div class="loading-header-minimal">
+        <div class="loading-spinner"></div>
+        <span class="cycling-status" id="status-text">Searching the web...</span>
+    </div>
+    
+    <div class="progress-bar-minimal">
+        <div class="progress-fill-minimal"></div>
+    </div>
+</div>
+"""
+
+_PAGE_SCRIPT = """
+<script>
+const statusMessages = [
+    "Searching across multiple sources...",
+    "Found 8+ sources, analyzing content...",
+    "Processing articles and reports in parallel...",
+    "Extracting key information...",
+    "Cross-referencing multiple perspectives...",
+    "Synthesizing comprehensive response..."
+];
+let loadingInterval = null;
+
+window.__startLoadingAnim = () => {
+    clearInterval(loadingInterval);
+    let messageIndex = 0;
+    const started = Date.now();
+    
+    // The status element is looked up on every tick because it only appears
+    // once the server's response has rendered the loading HTML
+    const cycleMessages = () => {
+        const statusElement = document.getElementById('status-text');
+        if (statusElement) {
+            statusElement.textContent = statusMessages[messageIndex];
+            messageIndex = (messageIndex + 1) % statusMessages.length;
+        }
+        // Stop after 30 seconds
+        if (Date.now() - started > 30000) clearInterval(loadingInterval);
+    };
+    
+    // Continue every 1.5 seconds
+    loadingInterval = setInterval(cycleMessages, 1500);
+};
+
+// One listener for every example button: copy its data-q into the search box
+document.addEventListener('click', (event) => {
+    const button = event.target.closest('.example-btn');
+    if (!button) return;
+    const textarea = document.querySelector('textarea');
+    textarea.value = button.dataset.q;
+    textarea.dispatchEvent(new Event('input', { bubbles: true }));
+});
+</script>
+"""
+
+# How many searches may run at the same time across all users
+_SEARCH_CONCURRENCY = 8
+
+# Runs in the browser before handle_search and passes the query through untouched
+_START_LOADING_JS = "(query) => { window.__startLoadingAnim(); return query; }"
+
 def create_interface():
     """Create the enhanced interface"""
-    with gr.Blocks(css=custom_css, theme=gr.themes.Base(), title="Research Assistant") as demo:
+    # The theme defaults to a bundled webfont; point it at the same local stack as
+    # the CSS so no font file has to download (and no text waits on one).
+    theme = gr.themes.Base(
+        font=["-apple-system", "BlinkMacSystemFont", "Segoe UI", "system-ui", "sans-serif"],
+    )
+    with gr.Blocks(
+        css=custom_css,
+        theme=theme,
+        title="Research Assistant",
+        head=_PAGE_SCRIPT,
+        analytics_enabled=False,  # no telemetry requests on startup or per session
+    ) as demo:
         with gr.Column(elem_classes=["main-container"]):
             with gr.Column(elem_classes=["card"]):
                 # Logo
@@ -641,10 +763,10 @@ def create_interface():
                 # Example buttons
                 gr.HTML("""
                 <div class="examples-container">
-                    <button class="example-btn" onclick="document.querySelector('textarea').value='Latest AI trends'; document.querySelector('textarea').dispatchEvent(new Event('input'));">Latest AI trends</button>
-                    <button class="example-btn" onclick="document.querySelector('textarea').value='Quantum computing'; document.querySelector('textarea').dispatchEvent(new Event('input'));">Quantum computing</button>
-                    <button class="example-btn" onclick="document.querySelector('textarea').value='Renewable energy'; document.querySelector('textarea').dispatchEvent(new Event('input'));">Renewable energy</button>
-                    <button class="example-btn" onclick="document.querySelector('textarea').value='Medical breakthroughs'; document.querySelector('textarea').dispatchEvent(new Event('input'));">Medical breakthroughs</button>
+                    <button class="example-btn" data-q="Latest AI trends">Latest AI trends</button>
+                    <button class="example-btn" data-q="Quantum computing">Quantum computing</button>
+                    <button class="example-btn" data-q="Renewable energy">Renewable energy</button>
+                    <button class="example-btn" data-q="Medical breakthroughs">Medical breakthroughs</button>
                 </div>
                 """)
 
@@ -668,94 +790,69 @@ def create_interface():
         </div>
         """)
 
+        # The stripped query, handed from handle_search to complete_search
+        query_state = gr.State()
+
         # Event handlers with enhanced visual feedback
         def handle_search(query):
-            if not query.strip():
-                return "", gr.update(visible=False), gr.update(visible=False), "", ""
+            query = query.strip()
+            if not query:
+                return "", gr.update(visible=False), gr.update(visible=False), "", "", ""
 
             # Show question and minimal loading indicator
             question_html = f'<div style="font-size: 22px; font-weight: 400; color: #e5e5e5; margin: 30px 0 20px 0; line-height: 1.4; font-family: \'Helvetica\', Arial, sans-serif;">{query}</div>'
             
-            # Minimal loading animation with cycling text
-            loading_html = f"""
-            <div class="loading-container-minimal">
-                <div class="loading-header-minimal">
-                    <div class="loading-spinner"></div>
-                    <span class="cycling-status" id="status-text">Searching the web...</span>
-                </div>
-                
-                <div class="progress-bar-minimal">
-                    <div class="progress-fill-minimal"></div>
-                </div>
-            </div>
-            
-            <script>
-            const statusMessages = [
-                "Searching across multiple sources...",
-                "Found 8+ sources, analyzing content...",
-                "Processing articles and reports in parallel...",
-                "Extracting key information...",
-                "Cross-referencing multiple perspectives...",
-                "Synthesizing comprehensive response..."
-            ];
-            
-            let messageIndex = 0;
-            const statusElement = document.getElementById('status-text');
-            
-            const cycleMessages = () => {{
-                if (statusElement) {{
-                    statusElement.textContent = statusMessages[messageIndex];
-                    messageIndex = (messageIndex + 1) % statusMessages.length;
-                }}
-            }};
-            
-            // Start cycling immediately and continue every 1.5 seconds
-            cycleMessages();
-            const interval = setInterval(cycleMessages, 1500);
-            
-            // Clean up interval when component unmounts
-            setTimeout(() => clearInterval(interval), 30000);
-            </script>
-            """
-            
             return (
                 question_html,
                 gr.update(visible=True),
-                gr.update(visible=True, value=loading_html),
+                gr.update(visible=True, value=_LOADING_HTML),
+                "",
                 "",
-                ""
+                query
             )
         
-        def complete_search(query):
-            if not query.strip():
-                return gr.update(visible=False), "", ""
+        async def complete_search(query):
+            # Already stripped by handle_search
+            if not query:
+                yield gr.update(visible=False), "", ""
+                return
             
-            # Perform the actual search
-            answer, sources, _ = search_web_only(query)
-            
-            return gr.update(visible=False), answer, sources
+            # Perform the actual search. Sources arrive first, then the answer
+            # streams in; the loading indicator stays up until it starts.
+            async for answer, sources, _ in search_web_only(query):
+                yield gr.update(visible=not answer), answer, sources
 
         # Chain the events for visual feedback
         search_event = search_btn.click(
             handle_search,
             inputs=[query_input],
-            outputs=[question_display, results_container, loading_display, answer_output, sources_output]
+            outputs=[question_display, results_container, loading_display, answer_output, sources_output, query_state],
+            js=_START_LOADING_JS,
         ).then(
             complete_search,
-            inputs=[query_input],
-            outputs=[loading_display, answer_output, sources_output]
+            inputs=[query_state],
+            outputs=[loading_display, answer_output, sources_output],
+            concurrency_limit=_SEARCH_CONCURRENCY,
+            concurrency_id="search",
         )
         
         submit_event = query_input.submit(
             handle_search,
             inputs=[query_input],
-            outputs=[question_display, results_container, loading_display, answer_output, sources_output]
+            outputs=[question_display, results_container, loading_display, answer_output, sources_output, query_state],
+            js=_START_LOADING_JS,
         ).then(
             complete_search,
-            inputs=[query_input],
-            outputs=[loading_display, answer_output, sources_output]
+            inputs=[query_state],
+            outputs=[loading_display, answer_output, sources_output],
+            concurrency_limit=_SEARCH_CONCURRENCY,
+            concurrency_id="search",
         )
 
+    # Searches spend nearly all their time waiting on the network, so several
+    # can run at once; "search" above makes clicks and submits share one limit.
+    demo.queue(default_concurrency_limit=_SEARCH_CONCURRENCY, max_size=64)
+
     return demo
 
 
@@ -764,4 +861,4 @@ if __name__ == "__main__":
         print("Warning: OPENROUTER_API_KEY not found in environment variables")
 
     demo = create_interface()
-    demo.launch(server_name="127.0.0.1", server_port=7868, share=False, debug=True, show_error=True)
+    demo.launch(server_name="127.0.0.1", server_port=7868, share=False, debug=False, show_error=True, max_threads=40)
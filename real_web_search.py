@@ -1,13 +1,153 @@
 # Real web search implementation using Tavily API and web scraping
 import asyncio
+import atexit
+import functools
 import os
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
-import requests
-from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
+import httpx
+from http_clients import LoopClients
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 import time
 
+try:
+    # Lexbor-backed parser, many times faster than BeautifulSoup for scraping
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import h2  # enables HTTP/2 in httpx
+except ImportError:
+    h2 = None
+
+try:
+    import lxml  # C parser for BeautifulSoup, several times faster than html.parser
+    _SOUP_PARSER = 'lxml'
+except ImportError:
+    _SOUP_PARSER = 'html.parser'
+
+# DuckDuckGo's result blocks, the only part of its results page we read. Matched
+# with a pattern because those divs carry several classes, and a strainer (unlike
+# find_all) compares a plain string against the whole class attribute.
+_RESULT_STRAINER = SoupStrainer('div', class_=re.compile(r'(?:^|\s)result__body(?:\s|$)'))
+
+# Most of a page we read when scraping; the text we keep is near the top anyway
+_MAX_PAGE_BYTES = 512 * 1024
+
+# Responses that can't hold readable text, so they aren't downloaded at all.
+# Anything else (HTML, plain text, XML...) is scraped as before.
+_BINARY_CONTENT_TYPES = (
+    'application/pdf', 'application/octet-stream', 'application/zip',
+    'image/', 'audio/', 'video/', 'font/',
+)
+
+# Page furniture that never holds the article text
+_STRIP_TAGS = ("script", "style", "nav", "footer", "header")
+
+# Enhanced content extraction with priority selectors
+_CONTENT_SELECTORS = (
+    'article', 'main', '[role="main"]', '.content', '.post-content', 
+    '.entry-content', '.article-body', '.story-body', '.post-body',
+    'section', '.container', '.wrapper'
+)
+_CONTENT_QUERY = ', '.join(_CONTENT_SELECTORS)
+
+# Each selector is a tag, a role or a class; these map each one back to its
+# priority so a single walk over the page can serve all of them
+_TAG_PRIORITY = {}
+_ROLE_PRIORITY = {}
+_CLASS_PRIORITY = {}
+for _priority, _selector in enumerate(_CONTENT_SELECTORS):
+    if _selector.startswith('.'):
+        _CLASS_PRIORITY[_selector[1:]] = _priority
+    elif _selector.startswith('[role='):
+        _ROLE_PRIORITY[_selector[len('[role="'):-len('"]')]] = _priority
+    else:
+        _TAG_PRIORITY[_selector] = _priority
+del _priority, _selector
+
+def _selector_priorities(tag: str, role: Optional[str], classes) -> List[int]:
+    """Priorities of the content selectors an element matches"""
+    priorities = [_CLASS_PRIORITY[cls] for cls in classes if cls in _CLASS_PRIORITY]
+    if tag in _TAG_PRIORITY:
+        priorities.append(_TAG_PRIORITY[tag])
+    if role in _ROLE_PRIORITY:
+        priorities.append(_ROLE_PRIORITY[role])
+    return priorities
+
+def _extract_content(html: bytes) -> str:
+    """Pull the main text out of a page, using selectolax when it's installed"""
+    # First element (in page order) for each content selector, found in one walk
+    candidates = {}
+    
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        
+        # Remove script and style elements
+        for node in tree.css(','.join(_STRIP_TAGS)):
+            node.decompose()
+        
+        for node in tree.css(_CONTENT_QUERY):
+            attrs = node.attributes
+            for priority in _selector_priorities(node.tag, attrs.get('role'), (attrs.get('class') or '').split()):
+                candidates.setdefault(priority, node)
+        
+        body = tree.body
+        get_text = lambda node: node.text(separator=' ', strip=True)
+    else:
+        soup = BeautifulSoup(html, _SOUP_PARSER)
+        
+        # Remove script and style elements
+        for script in soup(_STRIP_TAGS):
+            script.decompose()
+        
+        for element in soup.find_all(True):
+            for priority in _selector_priorities(element.name, element.get('role'), element.get('class') or ()):
+                candidates.setdefault(priority, element)
+        
+        body = soup.find('body')
+        get_text = lambda element: element.get_text(strip=True, separator=' ')
+    
+    content = ""
+    for priority in sorted(candidates):
+        content = get_text(candidates[priority])
+        if len(content) > 100:  # Only use if substantial content
+            break
+    
+    # Fallback to body content if no structured content found
+    if (not content or len(content) < 100) and body:
+        content = get_text(body)
+    return content.strip()
+
+# Characters dropped from scraped text, compiled once rather than looked up per call
+_RE_SPECIAL = re.compile(r'[^\w\s.,!?;:()-]')
+
+def _clean_text(text: str, limit: int) -> str:
+    """
+    Enhanced content cleanup: normalize whitespace and remove special characters,
+    returning at most `limit` characters.
+    
+    Pages are often many times longer than what we keep, so only a prefix is
+    cleaned, growing it until there's enough text left after cleanup.
+    """
+    cut = limit * 2
+    while True:
+        cleaned = ' '.join(text[:cut].split())  # Normalize whitespace
+        cleaned = _RE_SPECIAL.sub('', cleaned)  # Remove special chars
+        if len(cleaned) > limit or cut >= len(text):
+            return cleaned[:limit]
+        cut *= 2
+
+@functools.lru_cache(maxsize=4096)
+def _domain_of(url: str) -> str:
+    """Domain of a URL, remembered because the same sites come up again and again"""
+    if url.startswith('http'):
+        return urlsplit(url).netloc or url
+    return url.partition('/')[0]
+
 @dataclass
 class SearchResult:
     title: str
@@ -26,7 +166,25 @@ class RealWebSearch:
     def __init__(self):
         self.tavily_api_key = os.getenv('TAVILY_API_KEY')
         # Removed HTMLSession to avoid lxml.html.clean dependency
-        self.session = requests.Session()
+        # One pooled async client for every fetch: scrapes run concurrently on
+        # the event loop and repeat visits to a host reuse the TCP/TLS connection
+        # (multiplexed over HTTP/2 when the h2 package is available). httpx
+        # clients are tied to the event loop they were first used on, so there
+        # is one per loop.
+        self._clients = LoopClients(lambda: httpx.AsyncClient(
+            follow_redirects=True,
+            http2=h2 is not None,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=httpx.Timeout(5, connect=2),
+        ))
+        self._tavily_client = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        return self._clients.get()
+    
+    async def aclose(self) -> None:
+        """Close the pooled connections used for searching and scraping"""
+        await self._clients.aclose()
         
     async def search_tavily(self, query: str, max_results: int = 5) -> List[SearchResult]:
         """Search using Tavily API for high-quality results"""
@@ -35,11 +193,15 @@ class RealWebSearch:
             return await self.search_fallback(query, max_results)
             
         try:
-            from tavily import TavilyClient
-            client = TavilyClient(api_key=self.tavily_api_key)
+            if self._tavily_client is None:
+                from tavily import TavilyClient
+                self._tavily_client = TavilyClient(api_key=self.tavily_api_key)
+            client = self._tavily_client
             
-            # Search with Tavily
-            response = client.search(
+            # Search with Tavily. Its client is synchronous, so the request runs in
+            # a worker thread instead of stalling every other search on the event loop
+            response = await asyncio.to_thread(
+                client.search,
                 query=query,
                 search_depth="advanced",
                 max_results=max_results,
@@ -72,11 +234,13 @@ class RealWebSearch:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
             
-            response = requests.get(search_url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
+            response = await self._get_client().get(search_url, headers=headers, timeout=10)
+            # Only the result blocks are turned into a tree; the rest of the page
+            # is skipped while parsing
+            soup = BeautifulSoup(response.content, _SOUP_PARSER, parse_only=_RESULT_STRAINER)
             
             results = []
-            result_elements = soup.find_all('div', class_='result__body')[:max_results]
+            result_elements = soup.find_all('div', class_='result__body', limit=max_results)
             
             for elem in result_elements:
                 title_elem = elem.find('a', class_='result__a')
@@ -103,13 +267,7 @@ class RealWebSearch:
     
     def _extract_domain(self, url: str) -> str:
         """Extract domain from URL"""
-        try:
-            if url.startswith('http'):
-                return url.split('/')[2]
-            else:
-                return url.split('/')[0]
-        except:
-            return url
+        return _domain_of(url)
     
     def _get_demo_results(self, query: str) -> List[SearchResult]:
         """Generate demo results when all search methods fail"""
@@ -137,41 +295,24 @@ class RealWebSearch:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            # Reduced timeout for faster response
-            response = requests.get(url, headers=headers, timeout=5)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "nav", "footer", "header"]):
-                script.decompose()
-            
-            # Enhanced content extraction with priority selectors
-            content_selectors = [
-                'article', 'main', '[role="main"]', '.content', '.post-content', 
-                '.entry-content', '.article-body', '.story-body', '.post-body',
-                'section', '.container', '.wrapper'
-            ]
-            
-            content = ""
-            for selector in content_selectors:
-                elements = soup.select(selector)
-                if elements:
-                    content = elements[0].get_text(strip=True, separator=' ')
-                    if len(content) > 100:  # Only use if substantial content
+            # Reduced timeout for faster response. The body is streamed (httpx
+            # decompresses it on the fly) and reading stops at _MAX_PAGE_BYTES,
+            # so a huge page can't eat memory or parse time
+            async with self._get_client().stream('GET', url, headers=headers, timeout=5) as response:
+                content_type = response.headers.get('content-type', '').lower()
+                if content_type.startswith(_BINARY_CONTENT_TYPES):
+                    return ""  # PDFs, images, archives... nothing we can extract text from
+                
+                html = bytearray()
+                async for chunk in response.aiter_bytes():
+                    html += chunk
+                    if len(html) >= _MAX_PAGE_BYTES:
                         break
             
-            # Fallback to body content if no structured content found
-            if not content or len(content) < 100:
-                body = soup.find('body')
-                if body:
-                    content = body.get_text(strip=True, separator=' ')
-            
-            # Enhanced content cleanup
-            content = re.sub(r'\s+', ' ', content)  # Normalize whitespace
-            content = re.sub(r'[^\w\s.,!?;:()-]', '', content)  # Remove special chars
+            content = _extract_content(bytes(html[:_MAX_PAGE_BYTES]))
             
             # Return more content but still limited for performance
-            return content[:3000]  # Increased from 5000 to 3000 for balance
+            return _clean_text(content, 3000)  # Increased from 5000 to 3000 for balance
             
         except Exception as e:
             print(f"Content scraping error for {url}: {e}")
@@ -179,7 +320,6 @@ class RealWebSearch:
     
     async def search_web(self, query: str, max_results: int = 5, scrape_content: bool = True) -> SearchResponse:
         """Optimized search function with parallel processing and selective scraping"""
-        import time
         start_time = time.time()
         
         # Get search results
@@ -187,36 +327,34 @@ class RealWebSearch:
         
         # Parallel content scraping for speed - but only for top results
         if scrape_content and results:
-            import asyncio
-            
-            # Only scrape content for results that don't already have substantial content
-            scrape_tasks = []
-            for result in results:
-                if result.url and (not result.content or len(result.content) < 200):
-                    scrape_tasks.append(self.scrape_content(result.url))
-                else:
-                    scrape_tasks.append(asyncio.create_task(asyncio.sleep(0)))  # No-op task
+            # Only scrape content for results that don't already have substantial content;
+            # keep each result's index so the scraped text lands back in the right place
+            to_scrape = [
+                (i, self.scrape_content(result.url))
+                for i, result in enumerate(results)
+                if result.url and (not result.content or len(result.content) < 200)
+            ]
             
             # Execute scraping in parallel with timeout
-            try:
-                scraped_contents = await asyncio.wait_for(
-                    asyncio.gather(*scrape_tasks, return_exceptions=True), 
-                    timeout=15  # 15 second timeout for all scraping
-                )
-                
-                # Update results with scraped content
-                for i, (result, scraped_content) in enumerate(zip(results, scraped_contents)):
-                    if isinstance(scraped_content, str) and scraped_content:
-                        result.content = scraped_content
-                    elif not result.content:
-                        result.content = result.snippet
-                        
-            except asyncio.TimeoutError:
-                print("Content scraping timed out, using snippets")
-                # Fall back to snippets for all results
-                for result in results:
-                    if not result.content:
-                        result.content = result.snippet
+            if to_scrape:
+                try:
+                    scraped_contents = await asyncio.wait_for(
+                        asyncio.gather(*(coro for _, coro in to_scrape), return_exceptions=True),
+                        timeout=15  # 15 second timeout for all scraping
+                    )
+                    
+                    # Update results with scraped content
+                    for (i, _), scraped_content in zip(to_scrape, scraped_contents):
+                        if isinstance(scraped_content, str) and scraped_content:
+                            results[i].content = scraped_content
+                            
+                except asyncio.TimeoutError:
+                    print("Content scraping timed out, using snippets")
+            
+            # Fall back to snippets for anything still without content
+            for result in results:
+                if not result.content:
+                    result.content = result.snippet
         
         search_time = time.time() - start_time
         
@@ -234,8 +372,14 @@ def get_web_search() -> RealWebSearch:
     global _web_search
     if _web_search is None:
         _web_search = RealWebSearch()
+        atexit.register(_close_web_search)
     return _web_search
 
+def _close_web_search() -> None:
+    """Shut down the shared client's keep-alive connections when the app exits"""
+    if _web_search is not None:
+        _web_search._clients.close()
+
 # Convenience function for backward compatibility
 async def search_web(query: str, max_results: int = 5) -> SearchResponse:
     """Search the web for a given query"""
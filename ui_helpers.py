@@ -0,0 +1,52 @@
+# Small helpers shared by the Gradio apps
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+def minify_css(css: str) -> str:
+    """Strip comments and redundant whitespace so pages ship less CSS"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+class AnswerCache:
+    """
+    Recently answered questions for the Gradio apps: normalized query ->
+    (time stored, answer HTML, sources HTML), least recently used first.
+    
+    Repeated questions (like the example prompts) skip search and synthesis;
+    entries expire after `ttl` seconds so answers don't go stale.
+    """
+    
+    def __init__(self, size: int = 256, ttl: float = 3600):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()
+    
+    @staticmethod
+    def key(query: str) -> str:
+        """Case and spacing don't change the answer, so they don't change the key"""
+        return " ".join(query.lower().split())
+    
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """The cached (answer, sources) for key, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, answer, sources = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return answer, sources
+    
+    def put(self, key: str, answer: str, sources: str) -> None:
+        self._entries[key] = (time.monotonic(), answer, sources)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
@@ -1,16 +1,25 @@
 # Vector embeddings and storage for RAG system
+import functools
+import itertools
 import os
 import pickle
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from dataclasses import dataclass, asdict
 import json
-from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
 import chromadb
 from chromadb.config import Settings
 import uuid
+import asyncio
+import threading
 from datetime import datetime
 
+# Embeddings are stored L2-normalized, so inner product ranks exactly like
+# cosine similarity without HNSW renormalizing vectors on every comparison.
+# Collections created earlier with "cosine" keep working unchanged.
+_COLLECTION_METADATA = {"hnsw:space": "ip"}
+
 @dataclass
 class Document:
     id: str
@@ -28,14 +37,17 @@ class SearchMatch:
 class VectorStore:
     """Vector store for document embeddings and retrieval"""
     
+    QUERY_CACHE_SIZE = 1024
+    CHUNK_BATCH_SIZE = 256  # Chunks embedded and added to ChromaDB per round
+    
     def __init__(self, collection_name: str = "rag_documents", persist_directory: str = "./chroma_db"):
         self.collection_name = collection_name
         self.persist_directory = persist_directory
         
-        # Initialize embedding model
-        print("Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("Embedding model loaded.")
+        # Recent query embeddings: normalized query -> embedding
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # Searches can run in several worker threads at once (see hybrid_search)
+        self._query_cache_lock = threading.Lock()
         
         # Initialize ChromaDB
         self.client = chromadb.PersistentClient(path=persist_directory)
@@ -47,10 +59,38 @@ class VectorStore:
         except:
             self.collection = self.client.create_collection(
                 name=collection_name,
-                metadata={"hnsw:space": "cosine"}
+                metadata=_COLLECTION_METADATA
             )
             print(f"Created new collection: {collection_name}")
     
+    @functools.cached_property
+    def embedding_model(self):
+        """
+        The embedding model, loaded on first use.
+        
+        Loading it (and importing sentence_transformers/torch) takes seconds,
+        and web-only searches through the RAG system never embed anything.
+        """
+        import torch
+        from sentence_transformers import SentenceTransformer
+        
+        print("Loading embedding model...")
+        if torch.cuda.is_available():
+            model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Half precision roughly doubles GPU throughput with no visible
+            # change in MiniLM's rankings
+            model.half()
+        else:
+            try:
+                # On CPU, ONNX Runtime runs MiniLM 2-4x faster than PyTorch and
+                # produces the same embeddings, so stored vectors stay comparable.
+                # Needs optimum[onnxruntime] (and sentence-transformers >= 3.2).
+                model = SentenceTransformer('all-MiniLM-L6-v2', backend='onnx')
+            except (ImportError, TypeError):
+                model = SentenceTransformer('all-MiniLM-L6-v2')
+        print("Embedding model loaded.")
+        return model
+    
     def add_document(self, content: str, metadata: Dict[str, Any], filename: str = "") -> str:
         """Add a single document to the vector store"""
         doc_id = str(uuid.uuid4())
@@ -63,13 +103,14 @@ class VectorStore:
             filename=filename
         )
         
-        # Generate embedding
-        embedding = self.embedding_model.encode(content).tolist()
+        # Generate embedding, kept as a (1, dim) array - Chroma takes NumPy
+        # arrays directly, so there's no need for a list of Python floats
+        embedding = self.embedding_model.encode([content], normalize_embeddings=True)
         
         # Add to ChromaDB
         self.collection.add(
             documents=[content],
-            embeddings=[embedding],
+            embeddings=embedding,
             metadatas=[{
                 **metadata,
                 'filename': filename,
@@ -82,54 +123,69 @@ class VectorStore:
         print(f"Added document: {filename or doc_id[:8]}")
         return doc_id
     
-    def add_document_chunks(self, chunks: List[str], metadata: Dict[str, Any], filename: str = "") -> List[str]:
-        """Add multiple chunks from a document to the vector store"""
-        doc_ids = []
-        embeddings = []
-        documents = []
-        metadatas = []
-        ids = []
+    def add_document_chunks(self, chunks: Iterable[str], metadata: Dict[str, Any], filename: str = "",
+                            total_chunks: Optional[int] = None) -> List[str]:
+        """
+        Add multiple chunks from a document to the vector store.
+        
+        chunks can be any iterable (e.g. ProcessedDocument.iter_chunks()); it is read
+        CHUNK_BATCH_SIZE chunks at a time, so only one batch of chunk strings and
+        embeddings is held in memory at once. Pass total_chunks when chunks has no len().
+        """
+        if total_chunks is None:
+            total_chunks = len(chunks)
+        chunks = iter(chunks)
+        
+        # The chunks are all added together, so they share one timestamp
+        added_date = datetime.now().isoformat()
         
-        for i, chunk in enumerate(chunks):
-            doc_id = str(uuid.uuid4())
-            doc_ids.append(doc_id)
+        doc_ids = []
+        while True:
+            documents = list(itertools.islice(chunks, self.CHUNK_BATCH_SIZE))
+            if not documents:
+                break
+            batch_ids = [str(uuid.uuid4()) for _ in documents]
             
-            # Generate embedding for chunk
-            embedding = self.embedding_model.encode(chunk).tolist()
-            embeddings.append(embedding)
-            documents.append(chunk)
+            metadatas = []
+            for i, doc_id in enumerate(batch_ids, start=len(doc_ids)):
+                # Create metadata for chunk
+                chunk_metadata = metadata.copy()
+                chunk_metadata.update(
+                    filename=filename,
+                    doc_id=doc_id,
+                    chunk_index=i,
+                    total_chunks=total_chunks,
+                    added_date=added_date
+                )
+                metadatas.append(chunk_metadata)
             
-            # Create metadata for chunk
-            chunk_metadata = {
-                **metadata,
-                'filename': filename,
-                'doc_id': doc_id,
-                'chunk_index': i,
-                'total_chunks': len(chunks),
-                'added_date': datetime.now().isoformat()
-            }
-            metadatas.append(chunk_metadata)
-            ids.append(doc_id)
-        
-        # Batch add to ChromaDB
-        self.collection.add(
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            ids=ids
-        )
+            # Generate embeddings for the whole batch in one call, so the model runs
+            # batches of chunks together instead of one forward pass per chunk
+            embeddings = self.embedding_model.encode(
+                documents, batch_size=64, show_progress_bar=False, convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            
+            # Batch add to ChromaDB
+            self.collection.add(
+                documents=documents,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                ids=batch_ids
+            )
+            doc_ids.extend(batch_ids)
         
-        print(f"Added {len(chunks)} chunks from: {filename or 'document'}")
+        print(f"Added {len(doc_ids)} chunks from: {filename or 'document'}")
         return doc_ids
     
     def search(self, query: str, n_results: int = 5, filter_metadata: Optional[Dict] = None) -> List[SearchMatch]:
         """Search for similar documents"""
         # Generate query embedding
-        query_embedding = self.embedding_model.encode(query).tolist()
+        query_embedding = self._embed_query(query)
         
         # Search in ChromaDB
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=query_embedding,
             n_results=n_results,
             where=filter_metadata
         )
@@ -146,7 +202,8 @@ class VectorStore:
                     chunk_index=results['metadatas'][0][i].get('chunk_index', 0)
                 )
                 
-                score = 1 - results['distances'][0][i]  # Convert distance to similarity
+                # Convert distance to similarity (Chroma's cosine and ip distances are both 1 - similarity)
+                score = 1 - results['distances'][0][i]
                 snippet = self._create_snippet(results['documents'][0][i], query)
                 
                 matches.append(SearchMatch(
@@ -157,21 +214,56 @@ class VectorStore:
         
         return matches
     
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, reusing the embedding when it was asked recently"""
+        # The model is uncased and splits on whitespace, so case and spacing
+        # don't change the embedding
+        key = " ".join(query.lower().split())
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                self._query_cache.move_to_end(key)
+                return embedding
+        
+        # Encode outside the lock so other threads' cache hits don't wait on the model
+        embedding = self.embedding_model.encode([query], normalize_embeddings=True)
+        with self._query_cache_lock:
+            self._query_cache[key] = embedding
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+    
     def _create_snippet(self, content: str, query: str, max_length: int = 200) -> str:
         """Create a snippet highlighting query terms"""
         query_terms = query.lower().split()
         content_lower = content.lower()
         
-        # Find the best position to start the snippet
-        best_pos = 0
-        max_matches = 0
+        # Find the best position to start the snippet: the first of the windows
+        # (one every 50 characters) containing the most query terms. Instead of
+        # slicing every window and searching it for every term, str.find jumps
+        # straight to each term's next occurrence, crediting the windows that
+        # contain it and skipping the ones that can't.
+        step = 50
+        n_windows = len(range(0, len(content) - max_length, step))
+        window_matches = [0] * n_windows
+        for term in query_terms:
+            window = 0  # first window not yet checked for this term
+            while window < n_windows:
+                pos = content_lower.find(term, window * step)
+                if pos == -1:
+                    break
+                # Windows that start at or before pos and still end after the term
+                first = max(window, -(-(pos + len(term) - max_length) // step))
+                last = min(pos // step, n_windows - 1)
+                for w in range(first, last + 1):
+                    window_matches[w] += 1
+                window = last + 1
         
-        for i in range(0, len(content) - max_length, 50):
-            snippet = content_lower[i:i + max_length]
-            matches = sum(1 for term in query_terms if term in snippet)
-            if matches > max_matches:
-                max_matches = matches
-                best_pos = i
+        best_pos = 0
+        max_matches = max(window_matches, default=0)
+        if max_matches:
+            best_pos = step * window_matches.index(max_matches)
         
         snippet = content[best_pos:best_pos + max_length]
         if best_pos > 0:
@@ -214,7 +306,7 @@ class VectorStore:
             self.client.delete_collection(name=self.collection_name)
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
+                metadata=_COLLECTION_METADATA
             )
             print("Collection cleared.")
         except Exception as e:
@@ -233,12 +325,13 @@ class RAGSystem:
         
         processed_doc = process_document(file_path)
         
-        if processed_doc.chunks and len(processed_doc.chunks) > 1:
+        if processed_doc.chunk_offsets is not None and len(processed_doc.chunk_offsets) > 1:
             # Add as chunks if document was chunked
             doc_ids = self.vector_store.add_document_chunks(
-                processed_doc.chunks,
+                processed_doc.iter_chunks(),
                 processed_doc.metadata,
-                processed_doc.filename
+                processed_doc.filename,
+                total_chunks=len(processed_doc.chunk_offsets)
             )
             return f"Added {len(doc_ids)} chunks from {processed_doc.filename}"
         else:
@@ -256,11 +349,12 @@ class RAGSystem:
         
         processed_doc = process_uploaded_document(uploaded_file)
         
-        if processed_doc.chunks and len(processed_doc.chunks) > 1:
+        if processed_doc.chunk_offsets is not None and len(processed_doc.chunk_offsets) > 1:
             doc_ids = self.vector_store.add_document_chunks(
-                processed_doc.chunks,
+                processed_doc.iter_chunks(),
                 processed_doc.metadata,
-                processed_doc.filename
+                processed_doc.filename,
+                total_chunks=len(processed_doc.chunk_offsets)
             )
             return f"Added {len(doc_ids)} chunks from {processed_doc.filename}"
         else:
@@ -275,33 +369,23 @@ class RAGSystem:
         """Search in the document knowledge base"""
         return self.vector_store.search(query, n_results)
     
-    def search_web(self, query: str, n_results: int = 3) -> List[Any]:
+    async def search_web(self, query: str, n_results: int = 3) -> List[Any]:
         """Search the web for information"""
         if self.web_search is None:
             from real_web_search import get_web_search
             self.web_search = get_web_search()
         
-        import asyncio
-        
-        # Create event loop if needed
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        search_response = loop.run_until_complete(
-            self.web_search.search_web(query, n_results)
-        )
+        search_response = await self.web_search.search_web(query, n_results)
         return search_response.results
     
-    def hybrid_search(self, query: str, doc_results: int = 3, web_results: int = 2) -> Dict[str, Any]:
+    async def hybrid_search(self, query: str, doc_results: int = 3, web_results: int = 2) -> Dict[str, Any]:
         """Perform hybrid search combining documents and web results"""
-        # Search documents
-        doc_matches = self.search_documents(query, doc_results)
-        
-        # Search web
-        web_matches = self.search_web(query, web_results)
+        # The document search is embedding/HNSW work, so it runs in a worker thread
+        # while the web search waits on the network - total time is max(doc, web)
+        doc_matches, web_matches = await asyncio.gather(
+            asyncio.to_thread(self.search_documents, query, doc_results),
+            self.search_web(query, web_results),
+        )
         
         return {
             'document_results': doc_matches,